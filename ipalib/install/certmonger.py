@@ -249,6 +249,20 @@ def get_request_id(criteria):
         return None
 
 
+def get_request_ids_by_nickname(criteria):
+    """
+    Return a dict mapping the cert-nickname of every request that matches
+    the criteria to its request id. This lets callers look up many
+    requests without querying certmonger for each of them.
+    """
+    result = {}
+    for request in _get_requests(criteria):
+        props = request.prop_if.GetAll(DBUS_CM_REQUEST_IF)
+        result[props['cert-nickname']] = props['nickname']
+
+    return result
+
+
 def get_requests_for_dir(dir):
     """
     Return a list containing the request ids for a given NSS database
@@ -264,6 +278,24 @@ def get_requests_for_dir(dir):
     return reqid
 
 
+def get_requests_with_values(dir, directives):
+    """
+    Return a list of (request id, values) tuples for a given NSS database
+    directory, where values is a list of the values of the given request
+    properties. All properties of a request are fetched in a single call.
+    """
+    result = []
+    criteria = {'cert-storage': 'NSSDB', 'key-storage': 'NSSDB',
+                'cert-database': dir, 'key-database': dir, }
+    requests = _get_requests(criteria)
+    for request in requests:
+        props = request.prop_if.GetAll(DBUS_CM_REQUEST_IF)
+        result.append(
+            (props['nickname'], [props.get(d) for d in directives]))
+
+    return result
+
+
 def add_request_value(request_id, directive, value):
     """
     Add a new directive to a certmonger request file.
@@ -554,6 +586,8 @@ def dogtag_start_tracking(ca, nickname, pin, pinfile, secdir, pre_command,
     post_command is the script to execute after a renewal is done.
 
     Both commands can be None.
+
+    Returns the request id.
     """
 
     cm = _certmonger()
@@ -584,7 +618,18 @@ def dogtag_start_tracking(ca, nickname, pin, pinfile, secdir, pre_command,
     if profile:
         params['ca-profile'] = profile
 
-    cm.obj_if.add_request(params)
+    result = cm.obj_if.add_request(params)
+    try:
+        if result[0]:
+            request = _cm_dbus_object(cm.bus, cm, result[1],
+                                      DBUS_CM_REQUEST_IF, DBUS_CM_IF, True)
+        else:
+            raise RuntimeError('add_request() returned False')
+    except Exception as e:
+        root_logger.error('Failed to add new request: {error}'
+                          .format(error=e))
+        raise
+    return request.prop_if.Get(DBUS_CM_REQUEST_IF, 'nickname')
 
 
 def check_state(dirs):
@@ -40,6 +40,7 @@ import re
 
 from cryptography.hazmat.backends import default_backend
 import cryptography.x509
+from cryptography.hazmat.primitives import serialization
 from pyasn1.type import univ, char, namedtype, tag
 from pyasn1.codec.der import decoder, encoder
 from pyasn1_modules import rfc2315, rfc2459
@@ -186,6 +187,46 @@ def pkcs7_to_pems(data, datatype=PEM):
     return result
 
 
+def _der_wrap(tag, content):
+    """
+    Wrap DER encoded ``content`` into a TLV with the given one octet tag.
+    """
+    length = len(content)
+    if length < 0x80:
+        header = [tag, length]
+    else:
+        octets = []
+        while length:
+            octets.insert(0, length & 0xff)
+            length >>= 8
+        header = [tag, 0x80 | len(octets)] + octets
+    return bytes(bytearray(header)) + content
+
+
+def certs_to_pkcs7(certs):
+    """
+    Create a certificates-only PKCS #7 message, like
+    ``openssl crl2pkcs7 -nocrl`` does.
+
+    :param certs: sequence of python-cryptography ``Certificate`` objects
+    :return: DER encoded PKCS #7 signed data message
+    """
+    der_certs = b''.join(
+        cert.public_bytes(serialization.Encoding.DER) for cert in certs)
+    # the empty SETs are spelled out explicitly, the pyasn1 DER encoder
+    # would omit them
+    signed_data = _der_wrap(0x30, b''.join([
+        encoder.encode(univ.Integer(1)),                  # version
+        _der_wrap(0x31, b''),                             # digestAlgorithms
+        _der_wrap(0x30, encoder.encode(rfc2315.data)),    # contentInfo
+        _der_wrap(0xa0, der_certs),                       # certificates
+        _der_wrap(0x31, b''),                             # signerInfos
+    ]))
+    return _der_wrap(
+        0x30,
+        encoder.encode(rfc2315.signedData) + _der_wrap(0xa0, signed_data))
+
+
 def is_self_signed(certificate, datatype=PEM):
     cert = load_certificate(certificate, datatype)
     return cert.issuer == cert.subject
@@ -23,9 +23,10 @@ from __future__ import print_function
 
 import base64
 import dbus
+import errno
+import hashlib
 import ldap
 import os
-import pwd
 import re
 import shutil
 import sys
@@ -35,8 +36,10 @@ import tempfile
 import shlex
 import pipes
 
+import six
+
 # pylint: disable=import-error
-from six.moves.configparser import ConfigParser, RawConfigParser
+from six.moves.configparser import RawConfigParser
 # pylint: enable=import-error
 
 from ipalib import api
@@ -86,11 +89,78 @@ ConfigFile = /usr/share/pki/ca/conf/database.ldif
 """
 
 
-ADMIN_GROUPS = [
+ADMIN_GROUPS = (
     'Enterprise CA Administrators',
     'Enterprise KRA Administrators',
     'Security Domain Administrators'
-]
+)
+
+_PREOP_PIN_RE = re.compile(r'preop\.pin=(.*)')
+_PREOP_CA_TYPE_RE = re.compile(r'^\s*preop\.ca\.type=(.*)$', re.MULTILINE)
+_ENABLE_NONCES_RE = re.compile(r'^ca\.enableNonces=', re.MULTILINE)
+_PROFILE_LIST_RE = re.compile(r'^profile\.list=(\S*)', re.MULTILINE)
+_PROFILE_ATTR_RE = re.compile(
+    r'^profile\.([^.]+)\.(config|class_id)=(\S*)', re.MULTILINE)
+
+# characters dropped from Javascript variable values in get_value()
+_GET_VALUE_STRIP_RE = re.compile(r'[";]')
+
+# whitespace around line breaks, including blank lines, in PEM data
+_PEM_STRIP_RE = re.compile(r'\s*\n\s*')
+
+# Javascript variable name -> field, see get_defList() and get_outputList()
+_DEFLIST_FIELDS = {
+    'defList.defId': 'defId',
+    'defList.defVal': 'defVal',
+    'defList.defConstraint': 'defConstraint',
+}
+_OUTPUTLIST_FIELDS = {
+    'outputList.outputId': 'outputId',
+    'outputList.outputVal': 'outputVal',
+}
+
+# lines present in the Dogtag version of caIPAserviceCert only, see
+# repair_profile_caIPAserviceCert()
+_CAIPASERVICECERT_INDICATORS = frozenset([
+    ("policyset.serverCertSet.1.default.params.name="
+     "CN=$request.req_subject_name.cn$, OU=pki-ipa, O=IPA "),
+    ("policyset.serverCertSet.9.default.params.crlDistPointsPointName_0="
+     "https://ipa.example.com/ipa/crl/MasterCRL.bin"),
+])
+_CAIPASERVICECERT_INDICATORS_RE = re.compile(
+    r'^(%s)\r?$' % '|'.join(
+        re.escape(line) for line in _CAIPASERVICECERT_INDICATORS),
+    re.MULTILINE)
+
+# [global] options set by update_ipa_conf(), None removes the option
+_IPA_CONF_RA_OPTIONS = (
+    ('enable_ra', 'True'),
+    ('ra_plugin', 'dogtag'),
+    ('dogtag_version', '10'),
+    ('ca_host', None),
+)
+_IPA_CONF_SECTION_RE = re.compile(r'^\[([^\]]+)\]')
+_IPA_CONF_OPTION_RE = re.compile(r'^([^\s:=#;\[][^:=]*?)\s*[:=]')
+
+# LDAP filters for the renewal master flag and Dogtag people entries
+_RENEWAL_MASTER_FILTER = '(ipaConfigString=caRenewalMaster)'
+_CA_RENEWAL_MASTER_FILTER = '(&(cn=CA)(ipaConfigString=caRenewalMaster))'
+_INET_ORG_PERSON_FILTER = ldap2.ldap2.make_filter(
+    {'objectClass': 'inetOrgPerson'})
+
+# path -> ((st_mtime, st_size), content), see _read_cs_cfg()
+_cs_cfg_cache = {}
+# path -> (content, profile index), see _load_cs_cfg_profile_index()
+_cs_cfg_profile_index_cache = {}
+
+# subject base -> subject DNs, see _get_subject_dns()
+_subject_dns_cache = {}
+# realm -> LDAPI URI, see _dogtag_ldapi_uri()
+_dogtag_ldapi_uri_cache = {}
+# profile id -> profile configuration, see __get_profile_config()
+_profile_config_cache = {}
+# IPA suffix -> certificate subject base, see __get_profile_config()
+_subject_base_cache = {}
 
 
 def check_port():
@@ -103,8 +173,6 @@ def check_port():
 
 def get_preop_pin(instance_root, instance_name):
     # Only used for Dogtag 9
-    preop_pin = None
-
     filename = instance_root + "/" + instance_name + "/conf/CS.cfg"
 
     # read the config file and get the preop pin
@@ -113,29 +181,31 @@ def get_preop_pin(instance_root, instance_name):
     except IOError as e:
         root_logger.error("Cannot open configuration file." + str(e))
         raise e
-    data = f.read()
-    data = data.split('\n')
-    pattern = re.compile("preop.pin=(.*)")
-    for line in data:
-        match = re.search(pattern, line)
-        if match:
-            preop_pin = match.group(1)
-            break
+    with f:
+        for line in f:
+            match = _PREOP_PIN_RE.match(line)
+            if match:
+                return match.group(1)
 
-    if preop_pin is None:
-        raise RuntimeError(
-            "Unable to find preop.pin in %s. Is your CA already configured?" %
-            filename)
-
-    return preop_pin
+    raise RuntimeError(
+        "Unable to find preop.pin in %s. Is your CA already configured?" %
+        filename)
 
 
 def import_pkcs12(input_file, input_passwd, cert_database,
                   cert_passwd):
+    """
+    Import a PKCS#12 file into a NSS database.
+
+    ``input_passwd`` is the PKCS#12 file password itself, it is passed to
+    pk12util through a pipe so that it never hits the disk.
+    """
     ipautil.run([paths.PK12UTIL, "-d", cert_database,
                  "-i", input_file,
                  "-k", cert_passwd,
-                 "-w", input_passwd])
+                 "-w", paths.DEV_STDIN],
+                stdin=input_passwd + '\n',
+                nolog=(input_passwd,))
 
 
 def get_value(s):
@@ -144,9 +214,7 @@ def get_value(s):
     """
     try:
         expr = s.split('=', 1)
-        value = expr[1]
-        value = value.replace('\"', '')
-        value = value.replace(';', '')
+        value = _GET_VALUE_STRIP_RE.sub('', expr[1])
         value = value.replace('\\n', '\n')
         value = value.replace('\\r', '\r')
         return value
@@ -178,18 +246,21 @@ def get_defList(data):
             varname = None
             value = None
             skip = False
-        if d.startswith("defList.defId"):
+            continue
+
+        field = _DEFLIST_FIELDS.get(d.split('=', 1)[0].strip())
+        if field is None:
+            continue
+        if field == 'defId':
             varname = get_value(d)
-        if d.startswith("defList.defVal"):
+        elif field == 'defVal':
             value = get_value(d)
             if skip:
                 varname = None
                 value = None
                 skip = False
-        if d.startswith("defList.defConstraint"):
-            ctype = get_value(d)
-            if ctype == "readonly":
-                skip = True
+        elif get_value(d) == "readonly":
+            skip = True
 
         if varname and value:
             defdict[varname] = value
@@ -212,9 +283,14 @@ def get_outputList(data):
         if d.startswith("outputList = new"):
             varname = None
             value = None
-        if d.startswith("outputList.outputId"):
+            continue
+
+        field = _OUTPUTLIST_FIELDS.get(d.split('=', 1)[0].strip())
+        if field is None:
+            continue
+        if field == 'outputId':
             varname = get_value(d)
-        if d.startswith("outputList.outputVal"):
+        else:
             value = get_value(d)
 
         if varname and value:
@@ -235,21 +311,72 @@ def get_crl_files(path=None):
     if path is None:
         path = paths.PKI_CA_PUBLISH_DIR
 
-    files = os.listdir(path)
-    for f in files:
-        if f == "MasterCRL.bin":
-            yield os.path.join(path, f)
-        elif f.endswith(".der"):
+    for f in os.listdir(path):
+        if f == "MasterCRL.bin" or f.endswith(".der"):
             yield os.path.join(path, f)
 
 
+def _read_cs_cfg(path=None):
+    """
+    Return the content of CS.cfg.
+
+    The content is cached and re-read only when modification time or size
+    of the file changes.
+
+    @param path Custom CS.cfg path
+    """
+    if path is None:
+        path = paths.CA_CS_CFG_PATH
+
+    st = os.stat(path)
+    key = (st.st_mtime, st.st_size)
+    cached = _cs_cfg_cache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    with open(path) as f:
+        data = f.read()
+    _cs_cfg_cache[path] = (key, data)
+    return data
+
+
+def _load_cs_cfg_profile_index():
+    """
+    Return the list of profile ids in CS.cfg and a dict mapping each
+    profile id to its ``config`` and ``class_id`` settings.
+
+    The result is cached for as long as the CS.cfg content is, see
+    `_read_cs_cfg`.
+    """
+    cs_cfg = _read_cs_cfg()
+    cached = _cs_cfg_profile_index_cache.get(paths.CA_CS_CFG_PATH)
+    if cached is not None and cached[0] is cs_cfg:
+        return cached[1]
+
+    match = _PROFILE_LIST_RE.search(cs_cfg)
+    profile_ids = match.group(1).split(',')
+
+    # profile id -> {'config': ..., 'class_id': ...}, first occurrence wins
+    profile_attrs = {}
+    for match in _PROFILE_ATTR_RE.finditer(cs_cfg):
+        attrs = profile_attrs.setdefault(match.group(1), {})
+        attrs.setdefault(match.group(2), match.group(3))
+
+    index = (profile_ids, profile_attrs)
+    _cs_cfg_profile_index_cache[paths.CA_CS_CFG_PATH] = (cs_cfg, index)
+    return index
+
+
 def is_step_one_done():
     """Read CS.cfg and determine if step one of an external CA install is done
     """
     path = paths.CA_CS_CFG_PATH
     if not os.path.exists(path):
         return False
-    test = installutils.get_directive(path, 'preop.ca.type', '=')
+    match = _PREOP_CA_TYPE_RE.search(_read_cs_cfg(path))
+    if match is None:
+        return False
+    test = match.group(1).strip().strip('"')
     if test == "otherca":
         return True
     return False
@@ -262,6 +389,26 @@ def is_ca_installed_locally():
     return os.path.exists(paths.CA_CS_CFG_PATH)
 
 
+def _get_subject_dns(subject_base):
+    """
+    Return subject DNs of the fixed CA subsystem certificates as a dict of
+    strings. The result is cached per subject base.
+    """
+    try:
+        return _subject_dns_cache[subject_base]
+    except KeyError:
+        pass
+
+    subject_dns = {
+        'admin': str(DN(('cn', 'ipa-ca-agent'), subject_base)),
+        'subsystem': str(DN(('cn', 'CA Subsystem'), subject_base)),
+        'ocsp': str(DN(('cn', 'OCSP Subsystem'), subject_base)),
+        'audit': str(DN(('cn', 'CA Audit'), subject_base)),
+    }
+    _subject_dns_cache[subject_base] = subject_dns
+    return subject_dns
+
+
 def create_ca_user():
     """Create PKI user/group if it doesn't exist yet."""
     tasks.create_system_user(
@@ -320,11 +467,65 @@ class CAInstance(DogtagInstance):
         else:
             self.ra_agent_pwd = None
         self.ra_cert = None
+        # DER and parsed form of ra_cert
+        self._ra_cert_der = None
+        self._ra_cert_obj = None
+        self._ca_chain = None
+        # CS.cfg (directive, value) changes, see __update_cs_cfg()
+        self._cs_cfg_edits = []
         self.requestId = None
         self.log = log_mgr.get_logger(self)
         self.no_db_setup = False
         self.keytab = os.path.join(
             paths.PKI_TOMCAT, self.service_prefix + '.keytab')
+        self.__certmonger_bus = None
+        self.__certmonger_iface = None
+        # certmonger CA nickname -> D-Bus object path, see _find_ca_path()
+        self.__certmonger_ca_paths = {}
+        # fqdn -> bool, see is_renewal_master()
+        self._is_renewal_master_cache = {}
+
+    @property
+    def _certmonger_iface(self):
+        """
+        The certmonger D-Bus interface, bound once.
+        """
+        if self.__certmonger_iface is None:
+            self.__certmonger_bus = dbus.SystemBus()
+            obj = self.__certmonger_bus.get_object(
+                'org.fedorahosted.certmonger', '/org/fedorahosted/certmonger')
+            self.__certmonger_iface = dbus.Interface(
+                obj, 'org.fedorahosted.certmonger')
+            self.__certmonger_ca_paths = {}
+        return self.__certmonger_iface
+
+    def _reset_certmonger_iface(self):
+        """
+        Forget the bound certmonger interface, e.g. after a restart of
+        certmonger.
+        """
+        self.__certmonger_bus = None
+        self.__certmonger_iface = None
+        self.__certmonger_ca_paths = {}
+
+    def _find_ca_path(self, nickname):
+        """
+        Return the D-Bus object path of the certmonger CA with the given
+        nickname.
+        """
+        iface = self._certmonger_iface
+        if nickname not in self.__certmonger_ca_paths:
+            self.__certmonger_ca_paths[nickname] = (
+                iface.find_ca_by_nickname(nickname))
+        return self.__certmonger_ca_paths[nickname]
+
+    def _get_certmonger_ca_props(self, path):
+        """
+        Return the D-Bus properties interface of a certmonger CA.
+        """
+        ca_obj = self.__certmonger_bus.get_object(
+            'org.fedorahosted.certmonger', path)
+        return dbus.Interface(ca_obj, 'org.freedesktop.DBus.Properties')
 
     def configure_instance(self, host_name, dm_password, admin_password,
                            pkcs12_info=None, master_host=None, csr_file=None,
@@ -399,6 +600,7 @@ class CAInstance(DogtagInstance):
             self.step("backing up CS.cfg", self.backup_config)
             self.step("disabling nonces", self.__disable_nonce)
             self.step("set up CRL publishing", self.__enable_crl_publish)
+            self.step("updating CS.cfg", self.__update_cs_cfg)
             self.step("enable PKIX certificate path discovery and validation", self.enable_pkix)
             if promote:
                 self.step("destroying installation admin user", self.teardown_admin)
@@ -463,11 +665,14 @@ class CAInstance(DogtagInstance):
         # Create an empty and secured file
         (cfg_fd, cfg_file) = tempfile.mkstemp()
         os.close(cfg_fd)
-        pent = pwd.getpwnam(self.service_user)
+        pent = self._service_pent
         os.chown(cfg_file, pent.pw_uid, pent.pw_gid)
 
+        subject_dns = _get_subject_dns(self.subject_base)
+
         # Create CA configuration
-        config = ConfigParser()
+        # Passwords may contain '%', so no interpolation must be done
+        config = RawConfigParser()
         config.optionxform = str
         config.add_section("CA")
 
@@ -495,8 +700,7 @@ class CAInstance(DogtagInstance):
         config.set("CA", "pki_admin_email", "root@localhost")
         config.set("CA", "pki_admin_password", self.admin_password)
         config.set("CA", "pki_admin_nickname", "ipa-ca-agent")
-        config.set("CA", "pki_admin_subject_dn",
-            str(DN(('cn', 'ipa-ca-agent'), self.subject_base)))
+        config.set("CA", "pki_admin_subject_dn", subject_dns['admin'])
         config.set("CA", "pki_client_admin_cert_p12", paths.DOGTAG_ADMIN_P12)
 
         # Directory server
@@ -510,13 +714,12 @@ class CAInstance(DogtagInstance):
 
         # Certificate subject DN's
         config.set("CA", "pki_subsystem_subject_dn",
-            str(DN(('cn', 'CA Subsystem'), self.subject_base)))
-        config.set("CA", "pki_ocsp_signing_subject_dn",
-            str(DN(('cn', 'OCSP Subsystem'), self.subject_base)))
+            subject_dns['subsystem'])
+        config.set("CA", "pki_ocsp_signing_subject_dn", subject_dns['ocsp'])
         config.set("CA", "pki_ssl_server_subject_dn",
             str(DN(('cn', self.fqdn), self.subject_base)))
         config.set("CA", "pki_audit_signing_subject_dn",
-            str(DN(('cn', 'CA Audit'), self.subject_base)))
+            subject_dns['audit'])
         config.set(
             "CA", "pki_ca_signing_subject_dn",
             str(self.ca_subject))
@@ -539,9 +742,20 @@ class CAInstance(DogtagInstance):
                 config.set("CA", "pki_clone_reindex_data", "True")
 
             cafile = self.pkcs12_info[0]
-            shutil.copy(cafile, paths.TMP_CA_P12)
-            pent = pwd.getpwnam(self.service_user)
-            os.chown(paths.TMP_CA_P12, pent.pw_uid, pent.pw_gid)
+            # A hard link shares the owner with the original file, so it
+            # can be used instead of a copy only when the file is already
+            # owned by the service user.
+            st = os.stat(cafile)
+            linked = False
+            if (st.st_uid, st.st_gid) == (pent.pw_uid, pent.pw_gid):
+                try:
+                    os.link(cafile, paths.TMP_CA_P12)
+                    linked = True
+                except OSError:
+                    pass
+            if not linked:
+                shutil.copy(cafile, paths.TMP_CA_P12)
+                os.chown(paths.TMP_CA_P12, pent.pw_uid, pent.pw_gid)
 
             # Security domain registration
             config.set("CA", "pki_security_domain_hostname", self.master_host)
@@ -577,18 +791,16 @@ class CAInstance(DogtagInstance):
                 x509.write_certificate(f.read(), cert_file.name)
             cert_file.flush()
 
-            result = ipautil.run(
-                [paths.OPENSSL, 'crl2pkcs7',
-                 '-certfile', self.cert_chain_file,
-                 '-nocrl'],
-                capture_output=True)
-            cert_chain = result.output
-            # Dogtag chokes on the header and footer, remove them
+            certlist = x509.load_certificate_list_from_file(
+                self.cert_chain_file)
+            cert_chain = base64.b64encode(
+                x509.certs_to_pkcs7(certlist)).decode('ascii')
+            # Dogtag chokes on the PEM header and footer, only write the
+            # body, split to 64 character lines
             # https://bugzilla.redhat.com/show_bug.cgi?id=1127838
-            cert_chain = re.search(
-                r'(?<=-----BEGIN PKCS7-----).*?(?=-----END PKCS7-----)',
-                cert_chain, re.DOTALL).group(0)
-            cert_chain_file = ipautil.write_tmp_file(cert_chain)
+            cert_chain = '\n'.join(
+                cert_chain[i:i + 64] for i in range(0, len(cert_chain), 64))
+            cert_chain_file = ipautil.write_tmp_file(cert_chain + '\n')
 
             config.set("CA", "pki_external", "True")
             config.set("CA", "pki_external_ca_cert_path", cert_file.name)
@@ -600,8 +812,10 @@ class CAInstance(DogtagInstance):
         config.set("Tomcat", "pki_ajp_host", "::1")
 
         # Generate configuration file
-        with open(cfg_file, "wb") as f:
-            config.write(f)
+        buf = six.StringIO()
+        config.write(buf)
+        with open(cfg_file, "w") as f:
+            f.write(buf.getvalue())
 
         self.backup_state('installed', True)
         try:
@@ -636,14 +850,12 @@ class CAInstance(DogtagInstance):
         ld.update([paths.CA_TOPOLOGY_ULDIF])
 
     def __disable_nonce(self):
-        # Turn off Nonces
-        update_result = installutils.update_file(
-            paths.CA_CS_CFG_PATH, 'ca.enableNonces=true',
-            'ca.enableNonces=false')
-        if update_result != 0:
+        # Turn off Nonces, the change is written by __update_cs_cfg(). Fail
+        # right away if the directive is missing, instead of silently
+        # appending it to a CS.cfg that does not match the template.
+        if _ENABLE_NONCES_RE.search(_read_cs_cfg()) is None:
             raise RuntimeError("Disabling nonces failed")
-        pent = pwd.getpwnam(self.service_user)
-        os.chown(paths.CA_CS_CFG_PATH, pent.pw_uid, pent.pw_gid)
+        self._cs_cfg_edits.append(('ca.enableNonces', 'false'))
 
     def enable_pkix(self):
         installutils.set_directive(paths.SYSCONFIG_PKI_TOMCAT,
@@ -658,13 +870,8 @@ class CAInstance(DogtagInstance):
         Used when setting up replication
         """
         # Add the new RA cert to the database in /etc/httpd/alias
-        (agent_fd, agent_name) = tempfile.mkstemp()
-        os.write(agent_fd, self.dm_password)
-        os.close(agent_fd)
-        try:
-            import_pkcs12(rafile, agent_name, self.ra_agent_db, self.ra_agent_pwd)
-        finally:
-            os.remove(agent_name)
+        import_pkcs12(rafile, self.dm_password, self.ra_agent_db,
+                      self.ra_agent_pwd)
 
         self.configure_agent_renewal()
 
@@ -682,13 +889,11 @@ class CAInstance(DogtagInstance):
         """
 
         # get ipaCert certificate
-        cert_data = base64.b64decode(self.ra_cert)
-        cert = x509.load_certificate(cert_data, x509.DER)
+        cert_data = self._ra_cert_der
+        cert = self._ra_cert_obj
 
         # connect to CA database
-        server_id = installutils.realm_to_serverid(api.env.realm)
-        dogtag_uri = 'ldapi://%%2fvar%%2frun%%2fslapd-%s.socket' % server_id
-        conn = ldap2.ldap2(api, ldap_uri=dogtag_uri)
+        conn = ldap2.ldap2(api, ldap_uri=_dogtag_ldapi_uri())
         conn.connect(autobind=True)
 
         # create ipara user with ipaCert certificate
@@ -732,27 +937,32 @@ class CAInstance(DogtagInstance):
         return ipautil.run(new_args, stdin, nolog=(pwd_file,), **kwargs)
 
     def __get_ca_chain(self):
-        try:
-            return dogtag.get_ca_certchain(ca_host=self.fqdn)
-        except Exception as e:
-            raise RuntimeError("Unable to retrieve CA chain: %s" % str(e))
+        """
+        Return the DER encoded PKCS #7 CA chain.
+
+        The chain is retrieved from the CA only once and then cached.
+        """
+        if self._ca_chain is None:
+            try:
+                chain = dogtag.get_ca_certchain(ca_host=self.fqdn)
+            except Exception as e:
+                raise RuntimeError("Unable to retrieve CA chain: %s" % str(e))
+            # Convert to DER because the chain comes back as one long string
+            # which makes openssl throw up.
+            self._ca_chain = base64.b64decode(chain)
+        return self._ca_chain
 
     def __import_ca_chain(self):
         # Backup NSS trust flags of all already existing certificates
         certdb = certs.CertDB(self.realm)
         cert_backup_list = certdb.list_certs()
 
-        chain = self.__get_ca_chain()
+        data = self.__get_ca_chain()
 
         # If this chain contains multiple certs then certutil will only import
         # the first one. So we have to pull them all out and import them
         # separately. Unfortunately no NSS tool can do this so we have to
         # use openssl.
-
-        # Convert to DER because the chain comes back as one long string which
-        # makes openssl throw up.
-        data = base64.b64decode(chain)
-
         certlist = x509.pkcs7_to_pems(data, x509.DER)
 
         # Ok, now we have all the certificates in certs, walk through it
@@ -760,23 +970,18 @@ class CAInstance(DogtagInstance):
 
         ca_dn = DN(self.ca_subject)
         for cert in certlist:
-            try:
-                chain_fd, chain_name = tempfile.mkstemp()
-                os.write(chain_fd, cert)
-                os.close(chain_fd)
-                (_rdn, subject_dn) = certs.get_cert_nickname(cert)
-                if subject_dn == ca_dn:
-                    nick = get_ca_nickname(self.realm)
-                    trust_flags = 'CT,C,C'
-                else:
-                    nick = str(subject_dn)
-                    trust_flags = ',,'
-                self.__run_certutil(
-                    ['-A', '-t', trust_flags, '-n', nick, '-a',
-                     '-i', chain_name]
-                )
-            finally:
-                os.remove(chain_name)
+            (_rdn, subject_dn) = certs.get_cert_nickname(cert)
+            if subject_dn == ca_dn:
+                nick = get_ca_nickname(self.realm)
+                trust_flags = 'CT,C,C'
+            else:
+                nick = str(subject_dn)
+                trust_flags = ',,'
+            # certutil reads the certificate from stdin when -i is omitted
+            self.__run_certutil(
+                ['-A', '-t', trust_flags, '-n', nick, '-a'],
+                stdin=cert
+            )
 
         # Restore NSS trust flags of all previously existing certificates
         for nick, trust_flags in cert_backup_list:
@@ -792,8 +997,7 @@ class CAInstance(DogtagInstance):
         (chain_fd, chain_file) = tempfile.mkstemp(dir=paths.VAR_LIB_IPA)
         os.close(chain_fd)
 
-        chain = self.__get_ca_chain()
-        data = base64.b64decode(chain)
+        data = self.__get_ca_chain()
         result = ipautil.run(
             [paths.OPENSSL,
              "pkcs7",
@@ -835,9 +1039,10 @@ class CAInstance(DogtagInstance):
             result = self.__run_certutil(
                 ['-L', '-n', 'ipaCert', '-a'], capture_output=True)
             self.ra_cert = x509.strip_header(result.output)
-            self.ra_cert = "\n".join(
-                line.strip() for line
-                in self.ra_cert.splitlines() if line.strip())
+            self.ra_cert = _PEM_STRIP_RE.sub('\n', self.ra_cert).strip()
+            self._ra_cert_der = base64.b64decode(self.ra_cert)
+            self._ra_cert_obj = x509.load_certificate(
+                self._ra_cert_der, x509.DER)
         finally:
             # we can restore the helper parameters
             certmonger.modify_ca_helper(
@@ -864,7 +1069,7 @@ class CAInstance(DogtagInstance):
             os.mkdir(publishdir)
 
         os.chmod(publishdir, 0o775)
-        pent = pwd.getpwnam(self.service_user)
+        pent = self._service_pent
         os.chown(publishdir, 0, pent.pw_gid)
 
         tasks.restore_context(publishdir)
@@ -878,52 +1083,76 @@ class CAInstance(DogtagInstance):
 
         https://access.redhat.com/knowledge/docs/en-US/Red_Hat_Certificate_System/8.0/html/Admin_Guide/Setting_up_Publishing.html
         """
-        caconfig = paths.CA_CS_CFG_PATH
-
         publishdir = self.prepare_crl_publish_dir()
 
-        # Enable file publishing, disable LDAP
-        installutils.set_directive(caconfig, 'ca.publish.enable', 'true', quotes=False, separator='=')
-        installutils.set_directive(caconfig, 'ca.publish.ldappublish.enable', 'false', quotes=False, separator='=')
-
-        # Create the file publisher, der only, not b64
-        installutils.set_directive(caconfig, 'ca.publish.publisher.impl.FileBasedPublisher.class','com.netscape.cms.publish.publishers.FileBasedPublisher', quotes=False, separator='=')
-        installutils.set_directive(caconfig, 'ca.publish.publisher.instance.FileBaseCRLPublisher.crlLinkExt', 'bin', quotes=False, separator='=')
-        installutils.set_directive(caconfig, 'ca.publish.publisher.instance.FileBaseCRLPublisher.directory', publishdir, quotes=False, separator='=')
-        installutils.set_directive(caconfig, 'ca.publish.publisher.instance.FileBaseCRLPublisher.latestCrlLink', 'true', quotes=False, separator='=')
-        installutils.set_directive(caconfig, 'ca.publish.publisher.instance.FileBaseCRLPublisher.pluginName', 'FileBasedPublisher', quotes=False, separator='=')
-        installutils.set_directive(caconfig, 'ca.publish.publisher.instance.FileBaseCRLPublisher.timeStamp', 'LocalTime', quotes=False, separator='=')
-        installutils.set_directive(caconfig, 'ca.publish.publisher.instance.FileBaseCRLPublisher.zipCRLs', 'false', quotes=False, separator='=')
-        installutils.set_directive(caconfig, 'ca.publish.publisher.instance.FileBaseCRLPublisher.zipLevel', '9', quotes=False, separator='=')
-        installutils.set_directive(caconfig, 'ca.publish.publisher.instance.FileBaseCRLPublisher.Filename.b64', 'false', quotes=False, separator='=')
-        installutils.set_directive(caconfig, 'ca.publish.publisher.instance.FileBaseCRLPublisher.Filename.der', 'true', quotes=False, separator='=')
-
-        # The publishing rule
-        installutils.set_directive(caconfig, 'ca.publish.rule.instance.FileCrlRule.enable', 'true', quotes=False, separator='=')
-        installutils.set_directive(caconfig, 'ca.publish.rule.instance.FileCrlRule.mapper', 'NoMap', quotes=False, separator='=')
-        installutils.set_directive(caconfig, 'ca.publish.rule.instance.FileCrlRule.pluginName', 'Rule', quotes=False, separator='=')
-        installutils.set_directive(caconfig, 'ca.publish.rule.instance.FileCrlRule.predicate=', '', quotes=False, separator='')
-        installutils.set_directive(caconfig, 'ca.publish.rule.instance.FileCrlRule.publisher', 'FileBaseCRLPublisher', quotes=False, separator='=')
-        installutils.set_directive(caconfig, 'ca.publish.rule.instance.FileCrlRule.type', 'crl', quotes=False, separator='=')
-
-        # Now disable LDAP publishing
-        installutils.set_directive(caconfig, 'ca.publish.rule.instance.LdapCaCertRule.enable', 'false', quotes=False, separator='=')
-        installutils.set_directive(caconfig, 'ca.publish.rule.instance.LdapCrlRule.enable', 'false', quotes=False, separator='=')
-        installutils.set_directive(caconfig, 'ca.publish.rule.instance.LdapUserCertRule.enable', 'false', quotes=False, separator='=')
-        installutils.set_directive(caconfig, 'ca.publish.rule.instance.LdapXCertRule.enable', 'false', quotes=False, separator='=')
+        self._cs_cfg_edits.extend([
+            # Enable file publishing, disable LDAP
+            ('ca.publish.enable', 'true'),
+            ('ca.publish.ldappublish.enable', 'false'),
+
+            # Create the file publisher, der only, not b64
+            ('ca.publish.publisher.impl.FileBasedPublisher.class',
+             'com.netscape.cms.publish.publishers.FileBasedPublisher'),
+            ('ca.publish.publisher.instance.FileBaseCRLPublisher.crlLinkExt',
+             'bin'),
+            ('ca.publish.publisher.instance.FileBaseCRLPublisher.directory',
+             publishdir),
+            ('ca.publish.publisher.instance.FileBaseCRLPublisher.'
+             'latestCrlLink', 'true'),
+            ('ca.publish.publisher.instance.FileBaseCRLPublisher.pluginName',
+             'FileBasedPublisher'),
+            ('ca.publish.publisher.instance.FileBaseCRLPublisher.timeStamp',
+             'LocalTime'),
+            ('ca.publish.publisher.instance.FileBaseCRLPublisher.zipCRLs',
+             'false'),
+            ('ca.publish.publisher.instance.FileBaseCRLPublisher.zipLevel',
+             '9'),
+            ('ca.publish.publisher.instance.FileBaseCRLPublisher.'
+             'Filename.b64', 'false'),
+            ('ca.publish.publisher.instance.FileBaseCRLPublisher.'
+             'Filename.der', 'true'),
+
+            # The publishing rule
+            ('ca.publish.rule.instance.FileCrlRule.enable', 'true'),
+            ('ca.publish.rule.instance.FileCrlRule.mapper', 'NoMap'),
+            ('ca.publish.rule.instance.FileCrlRule.pluginName', 'Rule'),
+            ('ca.publish.rule.instance.FileCrlRule.predicate', ''),
+            ('ca.publish.rule.instance.FileCrlRule.publisher',
+             'FileBaseCRLPublisher'),
+            ('ca.publish.rule.instance.FileCrlRule.type', 'crl'),
+
+            # Now disable LDAP publishing
+            ('ca.publish.rule.instance.LdapCaCertRule.enable', 'false'),
+            ('ca.publish.rule.instance.LdapCrlRule.enable', 'false'),
+            ('ca.publish.rule.instance.LdapUserCertRule.enable', 'false'),
+            ('ca.publish.rule.instance.LdapXCertRule.enable', 'false'),
+        ])
 
         # If we are the initial master then we are the CRL generator, otherwise
         # we point to that master for CRLs.
         if not self.clone:
             # These next two are defaults, but I want to be explicit that the
             # initial master is the CRL generator.
-            installutils.set_directive(caconfig, 'ca.crl.MasterCRL.enableCRLCache', 'true', quotes=False, separator='=')
-            installutils.set_directive(caconfig, 'ca.crl.MasterCRL.enableCRLUpdates', 'true', quotes=False, separator='=')
-            installutils.set_directive(caconfig, 'ca.listenToCloneModifications', 'true', quotes=False, separator='=')
+            crl_generator = 'true'
         else:
-            installutils.set_directive(caconfig, 'ca.crl.MasterCRL.enableCRLCache', 'false', quotes=False, separator='=')
-            installutils.set_directive(caconfig, 'ca.crl.MasterCRL.enableCRLUpdates', 'false', quotes=False, separator='=')
-            installutils.set_directive(caconfig, 'ca.listenToCloneModifications', 'false', quotes=False, separator='=')
+            crl_generator = 'false'
+        self._cs_cfg_edits.extend([
+            ('ca.crl.MasterCRL.enableCRLCache', crl_generator),
+            ('ca.crl.MasterCRL.enableCRLUpdates', crl_generator),
+            ('ca.listenToCloneModifications', crl_generator),
+        ])
+
+    def __update_cs_cfg(self):
+        """
+        Write all queued CS.cfg changes in a single pass. The file is
+        replaced atomically and keeps its owner and mode.
+        """
+        if not self._cs_cfg_edits:
+            return
+        installutils.set_directives(
+            paths.CA_CS_CFG_PATH, self._cs_cfg_edits,
+            quotes=False, separator='=', atomic=True)
+        self._cs_cfg_edits = []
 
     def uninstall(self):
         # just eat state
@@ -941,37 +1170,26 @@ class CAInstance(DogtagInstance):
         services.knownservices.messagebus.start()
         cmonger = services.knownservices.certmonger
         cmonger.start()
+        # an interface bound before the restart would be stale
+        self._reset_certmonger_iface()
 
-        bus = dbus.SystemBus()
-        obj = bus.get_object('org.fedorahosted.certmonger',
-                             '/org/fedorahosted/certmonger')
-        iface = dbus.Interface(obj, 'org.fedorahosted.certmonger')
-        path = iface.find_ca_by_nickname('dogtag-ipa-ca-renew-agent')
+        path = self._find_ca_path('dogtag-ipa-ca-renew-agent')
         if path:
-            iface.remove_known_ca(path)
+            self._certmonger_iface.remove_known_ca(path)
+            del self.__certmonger_ca_paths['dogtag-ipa-ca-renew-agent']
 
         helper = self.restore_state('certmonger_dogtag_helper')
         if helper:
-            path = iface.find_ca_by_nickname('dogtag-ipa-renew-agent')
+            path = self._find_ca_path('dogtag-ipa-renew-agent')
             if path:
-                ca_obj = bus.get_object('org.fedorahosted.certmonger', path)
-                ca_iface = dbus.Interface(ca_obj,
-                                          'org.freedesktop.DBus.Properties')
+                ca_iface = self._get_certmonger_ca_props(path)
                 ca_iface.Set('org.fedorahosted.certmonger.ca',
                              'external-helper', helper)
 
         cmonger.stop()
+        self._reset_certmonger_iface()
 
-        # remove CRL files
-        self.log.info("Remove old CRL files")
-        try:
-            for f in get_crl_files():
-                self.log.debug("Remove %s", f)
-                installutils.remove_file(f)
-        except OSError as e:
-            self.log.warning("Error while removing old CRL files: %s", e)
-
-        # remove CRL directory
+        # remove CRL directory, including the CRL files
         self.log.info("Remove CRL directory")
         if os.path.exists(paths.PKI_CA_PUBLISH_DIR):
             try:
@@ -981,13 +1199,9 @@ class CAInstance(DogtagInstance):
                                     "directory: %s", e)
 
     def publish_ca_cert(self, location):
-        args = ["-L", "-n", self.canickname, "-a"]
-        result = self.__run_certutil(
-            args, capture_output=True)
-        cert = result.output
-        fd = open(location, "w+")
-        fd.write(cert)
-        fd.close()
+        # let certutil write the certificate to the file directly
+        args = ["-L", "-n", self.canickname, "-a", "-o", location]
+        self.__run_certutil(args)
         os.chmod(location, 0o444)
 
 
@@ -1000,23 +1214,18 @@ class CAInstance(DogtagInstance):
         if not self.is_configured():
             return
 
-        bus = dbus.SystemBus()
-        obj = bus.get_object('org.fedorahosted.certmonger',
-                             '/org/fedorahosted/certmonger')
-        iface = dbus.Interface(obj, 'org.fedorahosted.certmonger')
-        path = iface.find_ca_by_nickname('dogtag-ipa-renew-agent')
+        path = self._find_ca_path('dogtag-ipa-renew-agent')
         if path:
-            ca_obj = bus.get_object('org.fedorahosted.certmonger', path)
-            ca_iface = dbus.Interface(ca_obj,
-                                      'org.freedesktop.DBus.Properties')
+            ca_iface = self._get_certmonger_ca_props(path)
             helper = ca_iface.Get('org.fedorahosted.certmonger.ca',
                                   'external-helper')
             if helper:
                 args = shlex.split(helper)
                 if args[0] != paths.IPA_SERVER_GUARD:
                     self.backup_state('certmonger_dogtag_helper', helper)
-                    args = [paths.IPA_SERVER_GUARD] + args
-                    helper = ' '.join(pipes.quote(a) for a in args)
+                    # the original arguments are already quoted
+                    helper = '%s %s' % (pipes.quote(paths.IPA_SERVER_GUARD),
+                                        helper)
                     ca_iface.Set('org.fedorahosted.certmonger.ca',
                                  'external-helper', helper)
 
@@ -1040,9 +1249,10 @@ class CAInstance(DogtagInstance):
         super(CAInstance, self).stop_tracking_certificates(False)
 
         # stop tracking lightweight CA signing certs
-        for request_id in certmonger.get_requests_for_dir(self.nss_db):
-            nickname = certmonger.get_request_value(request_id, 'key-nickname')
-            if nickname.startswith('caSigningCert cert-pki-ca '):
+        requests = certmonger.get_requests_with_values(
+            self.nss_db, ['key-nickname'])
+        for _request_id, (nickname,) in requests:
+            if nickname and nickname.startswith('caSigningCert cert-pki-ca '):
                 certmonger.stop_tracking(self.nss_db, nickname=nickname)
 
         try:
@@ -1069,17 +1279,11 @@ class CAInstance(DogtagInstance):
         self.log.debug(
             'caSignedLogCert.cfg profile validity range is %s', cert_range)
         if cert_range == "180":
-            installutils.set_directive(
-                paths.CASIGNEDLOGCERT_CFG,
-                'policyset.caLogSigningSet.2.default.params.range',
-                '720',
-                quotes=False,
-                separator='='
-            )
-            installutils.set_directive(
+            installutils.set_directives(
                 paths.CASIGNEDLOGCERT_CFG,
-                'policyset.caLogSigningSet.2.constraint.params.range',
-                '720',
+                [('policyset.caLogSigningSet.2.default.params.range', '720'),
+                 ('policyset.caLogSigningSet.2.constraint.params.range',
+                  '720')],
                 quotes=False,
                 separator='='
             )
@@ -1092,16 +1296,24 @@ class CAInstance(DogtagInstance):
         if fqdn is None:
             fqdn = api.env.host
 
+        try:
+            return self._is_renewal_master_cache[fqdn]
+        except KeyError:
+            pass
+
         dn = DN(('cn', 'CA'), ('cn', fqdn), ('cn', 'masters'), ('cn', 'ipa'),
                 ('cn', 'etc'), api.env.basedn)
-        renewal_filter = '(ipaConfigString=caRenewalMaster)'
         try:
-            api.Backend.ldap2.get_entries(base_dn=dn, filter=renewal_filter,
+            api.Backend.ldap2.get_entries(base_dn=dn,
+                                          filter=_RENEWAL_MASTER_FILTER,
                                           attrs_list=[])
         except errors.NotFound:
-            return False
+            result = False
+        else:
+            result = True
 
-        return True
+        self._is_renewal_master_cache[fqdn] = result
+        return result
 
     def set_renewal_master(self, fqdn=None):
         if fqdn is None:
@@ -1109,29 +1321,39 @@ class CAInstance(DogtagInstance):
 
         base_dn = DN(('cn', 'masters'), ('cn', 'ipa'), ('cn', 'etc'),
                      api.env.basedn)
-        filter = '(&(cn=CA)(ipaConfigString=caRenewalMaster))'
         try:
             entries = api.Backend.ldap2.get_entries(
-                base_dn=base_dn, filter=filter, attrs_list=['ipaConfigString'])
+                base_dn=base_dn, filter=_CA_RENEWAL_MASTER_FILTER,
+                attrs_list=['ipaConfigString'])
         except errors.NotFound:
             entries = []
 
-        dn = DN(('cn', 'CA'), ('cn', fqdn), base_dn)
-        master_entry = api.Backend.ldap2.get_entry(dn, ['ipaConfigString'])
+        master_dn = DN(('cn', 'CA'), ('cn', fqdn), base_dn)
+        if any(entry.dn == master_dn for entry in entries):
+            master_entry = None
+        else:
+            # the entry is only needed when the flag has to be added
+            master_entry = api.Backend.ldap2.get_entry(
+                master_dn, ['ipaConfigString'])
 
         for entry in entries:
-            if master_entry is not None and entry.dn == master_entry.dn:
-                master_entry = None
+            if entry.dn == master_dn:
                 continue
 
-            entry['ipaConfigString'] = [x for x in entry['ipaConfigString']
-                                        if x.lower() != 'carenewalmaster']
+            old_values = entry['ipaConfigString']
+            new_values = [x for x in old_values
+                          if x.lower() != 'carenewalmaster']
+            if len(new_values) == len(old_values):
+                continue
+            entry['ipaConfigString'] = new_values
             api.Backend.ldap2.update_entry(entry)
 
         if master_entry is not None:
             master_entry['ipaConfigString'].append('caRenewalMaster')
             api.Backend.ldap2.update_entry(master_entry)
 
+        self._is_renewal_master_cache.clear()
+
     @staticmethod
     def update_cert_config(nickname, cert):
         """
@@ -1149,14 +1371,23 @@ class CAInstance(DogtagInstance):
                       'subsystemCert cert-pki-ca': 'ca.subsystem.cert',
                       'Server-Cert cert-pki-ca': 'ca.sslserver.cert'}
 
+        if nickname not in directives:
+            return
+
+        directive = directives[nickname]
+        current = installutils.get_directive(
+            paths.CA_CS_CFG_PATH, directive + '=', separator='=')
+        if current == base64.b64encode(cert).decode('ascii'):
+            # CS.cfg already has the certificate
+            return
+
         try:
             backup_config()
         except Exception as e:
             syslog.syslog(syslog.LOG_ERR, "Failed to backup CS.cfg: %s" % e)
 
-        if nickname in directives:
-            DogtagInstance.update_cert_cs_cfg(
-                directives[nickname], cert, paths.CA_CS_CFG_PATH)
+        DogtagInstance.update_cert_cs_cfg(
+            directive, cert, paths.CA_CS_CFG_PATH)
 
     def __create_ds_db(self):
         '''
@@ -1221,14 +1452,13 @@ class CAInstance(DogtagInstance):
             ('features.authority.keyRetrieverConfig.executable',
                 '/usr/libexec/ipa/ipa-pki-retrieve-key'),
         ]
-        for k, v in directives:
-            installutils.set_directive(
-                paths.CA_CS_CFG_PATH, k, v, quotes=False, separator='=')
+        installutils.set_directives(
+            paths.CA_CS_CFG_PATH, directives, quotes=False, separator='=')
 
         sysupgrade.set_upgrade_state('dogtag', 'setup_lwca_key_retieval', True)
 
     def __setup_lightweight_ca_key_retrieval_kerberos(self):
-        pent = pwd.getpwnam(self.service_user)
+        pent = self._service_pent
 
         root_logger.info('Creating principal')
         installutils.kadmin_addprinc(self.principal)
@@ -1241,21 +1471,17 @@ class CAInstance(DogtagInstance):
         os.chown(self.keytab, pent.pw_uid, pent.pw_gid)
 
     def __setup_lightweight_ca_key_retrieval_custodia(self):
-        pent = pwd.getpwnam(self.service_user)
+        pent = self._service_pent
 
         root_logger.info('Creating Custodia keys')
         custodia_basedn = DN(
             ('cn', 'custodia'), ('cn', 'ipa'), ('cn', 'etc'), api.env.basedn)
-        ensure_entry(
-            custodia_basedn,
-            objectclass=['top', 'nsContainer'],
-            cn=['custodia'],
-        )
-        ensure_entry(
-            DN(('cn', 'dogtag'), custodia_basedn),
-            objectclass=['top', 'nsContainer'],
-            cn=['dogtag'],
-        )
+        ensure_dn_chain([
+            (custodia_basedn,
+             dict(objectclass=['top', 'nsContainer'], cn=['custodia'])),
+            (DN(('cn', 'dogtag'), custodia_basedn),
+             dict(objectclass=['top', 'nsContainer'], cn=['dogtag'])),
+        ])
         keyfile = os.path.join(paths.PKI_TOMCAT, self.service_prefix + '.keys')
         keystore = IPAKEMKeys({'server_keys': keyfile})
         keystore.generate_keys(self.service_prefix)
@@ -1265,14 +1491,17 @@ class CAInstance(DogtagInstance):
     def __add_lightweight_ca_tracking_requests(self):
         try:
             lwcas = api.Backend.ldap2.get_entries(
-                base_dn=api.env.basedn,
-                filter='(objectclass=ipaca)',
+                base_dn=DN(api.env.container_ca, api.env.basedn),
+                scope=api.Backend.ldap2.SCOPE_ONELEVEL,
+                # the IPA CA is tracked separately
+                filter='(&(objectclass=ipaca)(!(cn=%s)))' % (
+                    ipalib.constants.IPA_CA_CN),
                 attrs_list=['cn', 'ipacaid'],
+                paged_search=True,
             )
             add_lightweight_ca_tracking_requests(self.log, lwcas)
         except errors.NotFound:
-            # shouldn't happen, but don't fail if it does
-            root_logger.warning(
+            root_logger.debug(
                 "Did not find any lightweight CAs; nothing to track")
 
     def __dogtag10_migration(self):
@@ -1301,9 +1530,19 @@ def replica_ca_install_check(config, promote):
                 force_schema_updates=False) as connection:
             connection.simple_bind(bind_dn=ipaldap.DIRMAN_DN,
                                    bind_password=config.dirman_password)
-            rschema = connection.schema
-            result = rschema.get_obj(ldap.schema.models.ObjectClass,
-                                     objectclass)
+            # Only fetch the object classes, and do not let the client
+            # decode them, which would make it retrieve the full schema
+            schema_entry = connection.conn.search_s(
+                'cn=schema', ldap.SCOPE_BASE, attrlist=['objectClasses'])
+            name_re = re.compile(
+                r"NAME\s+(?:'%s'|\([^)]*'%s')" % (objectclass, objectclass),
+                re.IGNORECASE)
+            values = [
+                v.decode('utf-8') if isinstance(v, bytes) else v
+                for _dn, attrs in schema_entry
+                for vals in attrs.values()
+                for v in vals]
+            result = any(name_re.search(v) for v in values)
     except Exception:
         root_logger.critical(
             'CA DS schema check failed. Make sure the PKI service on the '
@@ -1330,7 +1569,39 @@ def backup_config():
     if services.knownservices['pki_tomcatd'].is_running('pki-tomcat'):
         raise RuntimeError(
             "Dogtag must be stopped when creating backup of %s" % path)
-    shutil.copy(path, path + '.ipabkp')
+    backup = path + '.ipabkp'
+
+    # The backup keeps the modification time of CS.cfg, so an up to date
+    # backup need not be copied again.
+    src_st = os.stat(path)
+    try:
+        dst_st = os.stat(backup)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    else:
+        if ((dst_st.st_mtime, dst_st.st_size) ==
+                (src_st.st_mtime, src_st.st_size)):
+            return
+
+    tmp = backup + '.tmp'
+    shutil.copy2(path, tmp)
+    os.rename(tmp, backup)
+
+
+def _dogtag_ldapi_uri():
+    """
+    Return the LDAPI URI of the directory server holding the Dogtag
+    database.
+    """
+    try:
+        return _dogtag_ldapi_uri_cache[api.env.realm]
+    except KeyError:
+        server_id = installutils.realm_to_serverid(api.env.realm)
+        uri = 'ldapi://%%2fvar%%2frun%%2fslapd-%s.socket' % server_id
+        _dogtag_ldapi_uri_cache[api.env.realm] = uri
+        return uri
+
 
 def __update_entry_from_cert(make_filter, make_entry, dercert):
     """
@@ -1360,11 +1631,10 @@ def __update_entry_from_cert(make_filter, make_entry, dercert):
     base_dn = DN(('o', 'ipaca'))
 
     attempts = 0
-    server_id = installutils.realm_to_serverid(api.env.realm)
-    dogtag_uri = 'ldapi://%%2fvar%%2frun%%2fslapd-%s.socket' % server_id
+    dogtag_uri = _dogtag_ldapi_uri()
     updated = False
 
-    while attempts < 10:
+    while attempts < 8:
         conn = None
         try:
             conn = ldap2.ldap2(api, ldap_uri=dogtag_uri)
@@ -1395,10 +1665,12 @@ def __update_entry_from_cert(make_filter, make_entry, dercert):
 
             break
         except errors.NetworkError:
+            # back off exponentially, up to 30 seconds
+            delay = min(30, 1 << attempts)
             syslog.syslog(
                 syslog.LOG_ERR,
-                'Connection to %s failed, sleeping 30s' % dogtag_uri)
-            time.sleep(30)
+                'Connection to %s failed, sleeping %ds' % (dogtag_uri, delay))
+            time.sleep(delay)
             attempts += 1
         except Exception as e:
             syslog.syslog(syslog.LOG_ERR, 'Caught unhandled exception: %s' % e)
@@ -1419,13 +1691,14 @@ def update_people_entry(dercert):
     Update the userCerticate for an entry in the dogtag ou=People. This
     is needed when a certificate is renewed.
     """
+    cert = x509.load_certificate(dercert, datatype=x509.DER)
+    subject = DN(cert.subject)
+    issuer = DN(cert.issuer)
+
     def make_filter(dercert):
-        cert = x509.load_certificate(dercert, datatype=x509.DER)
-        subject = DN(cert.subject)
-        issuer = DN(cert.issuer)
         return ldap2.ldap2.combine_filters(
             [
-                ldap2.ldap2.make_filter({'objectClass': 'inetOrgPerson'}),
+                _INET_ORG_PERSON_FILTER,
                 ldap2.ldap2.make_filter(
                     {'description': ';%s;%s' % (issuer, subject)},
                     exact=False, trailing_wildcard=False),
@@ -1433,12 +1706,8 @@ def update_people_entry(dercert):
             ldap2.ldap2.MATCH_ALL)
 
     def make_entry(dercert, entry):
-        cert = x509.load_certificate(dercert, datatype=x509.DER)
-        serial_number = cert.serial
-        subject = DN(cert.subject)
-        issuer = DN(cert.issuer)
         entry['usercertificate'].append(dercert)
-        entry['description'] = '2;%d;%s;%s' % (serial_number, issuer, subject)
+        entry['description'] = '2;%d;%s;%s' % (cert.serial, issuer, subject)
         return entry
 
     return __update_entry_from_cert(make_filter, make_entry, dercert)
@@ -1449,8 +1718,9 @@ def update_authority_entry(dercert):
     Find the authority entry for the given cert, and update the
     serial number to match the given cert.
     """
+    cert = x509.load_certificate(dercert, datatype=x509.DER)
+
     def make_filter(dercert):
-        cert = x509.load_certificate(dercert, datatype=x509.DER)
         subject = str(DN(cert.subject))
         return ldap2.ldap2.make_filter(
             dict(objectclass='authority', authoritydn=subject),
@@ -1458,7 +1728,6 @@ def update_authority_entry(dercert):
         )
 
     def make_entry(dercert, entry):
-        cert = x509.load_certificate(dercert, datatype=x509.DER)
         entry['authoritySerial'] = cert.serial
         return entry
 
@@ -1487,12 +1756,8 @@ def ensure_entry(dn, **attrs):
     otherwise add the entry and return ``True``.
 
     """
-    server_id = installutils.realm_to_serverid(api.env.realm)
-    dogtag_uri = 'ldapi://%%2fvar%%2frun%%2fslapd-%s.socket' % server_id
-
-    conn = ldap2.ldap2(api, ldap_uri=dogtag_uri)
-    if not conn.isconnected():
-        conn.connect(autobind=True)
+    conn = ldap2.ldap2(api, ldap_uri=_dogtag_ldapi_uri())
+    conn.connect(autobind=True)
 
     try:
         conn.get_entry(dn)
@@ -1506,6 +1771,37 @@ def ensure_entry(dn, **attrs):
         conn.disconnect()
 
 
+def ensure_dn_chain(chain):
+    """Ensure a chain of entries exists.
+
+    ``chain`` is a list of ``(dn, attrs)`` pairs where each entry is the
+    parent of the next one. The deepest entry is looked up first and
+    only the missing entries are added, parents first.
+
+    Return ``True`` if any entry was added, otherwise ``False``.
+
+    """
+    conn = ldap2.ldap2(api, ldap_uri=_dogtag_ldapi_uri())
+    conn.connect(autobind=True)
+
+    try:
+        missing = []
+        for dn, attrs in reversed(chain):
+            try:
+                conn.get_entry(dn)
+            except errors.NotFound:
+                missing.append((dn, attrs))
+            else:
+                break
+
+        for dn, attrs in reversed(missing):
+            conn.add_entry(conn.make_entry(dn, **attrs))
+    finally:
+        conn.disconnect()
+
+    return bool(missing)
+
+
 def configure_profiles_acl():
     """Allow the Certificate Manager Agents group to modify profiles."""
     new_rules = [
@@ -1541,6 +1837,18 @@ def configure_lightweight_ca_acls():
     return __add_acls(new_rules)
 
 
+def _prepare_ra_backend(backend):
+    """
+    Make a Dogtag REST API backend use the local CA agent port.
+
+    The RA agent password is read in the backend constructor and only
+    needs to be read again if the password file did not exist then.
+    """
+    if not backend.password:
+        backend._read_password()
+    backend.override_port = 8443
+
+
 def __add_acls(new_rules):
     """Add the given Dogtag ACLs.
 
@@ -1550,80 +1858,116 @@ def __add_acls(new_rules):
     Return ``True`` if any ACLs were added otherwise ``False``.
 
     """
-    server_id = installutils.realm_to_serverid(api.env.realm)
-    dogtag_uri = 'ldapi://%%2fvar%%2frun%%2fslapd-%s.socket' % server_id
     updated = False
 
     dn = DN(('cn', 'aclResources'), ('o', 'ipaca'))
 
-    conn = ldap2.ldap2(api, ldap_uri=dogtag_uri)
-    if not conn.isconnected():
-        conn.connect(autobind=True)
-    cur_rules = conn.get_entry(dn).get('resourceACLS', [])
-    add_rules = [rule for rule in new_rules if rule not in cur_rules]
-    if add_rules:
-        conn.conn.modify_s(str(dn), [(ldap.MOD_ADD, 'resourceACLS', add_rules)])
-        updated = True
+    conn = ldap2.ldap2(api, ldap_uri=_dogtag_ldapi_uri())
+    conn.connect(autobind=True)
+    try:
+        cur_rules = frozenset(
+            conn.get_entry(dn, ['resourceACLS']).get('resourceACLS', []))
+        add_rules = []
+        for rule in new_rules:
+            if rule not in cur_rules and rule not in add_rules:
+                add_rules.append(rule)
+        if add_rules:
+            conn.conn.modify_s(
+                str(dn), [(ldap.MOD_ADD, 'resourceACLS', add_rules)])
+            updated = True
+    finally:
+        conn.disconnect()
 
-    conn.disconnect()
     return updated
 
 
 def __get_profile_config(profile_id):
+    """
+    Return the configuration of an included profile.
+
+    The result is cached, as is the subject base, which needs an LDAP
+    search to find.
+    """
+    try:
+        return _profile_config_cache[profile_id]
+    except KeyError:
+        pass
+
+    if api.env.basedn not in _subject_base_cache:
+        _subject_base_cache[api.env.basedn] = (
+            dsinstance.DsInstance().find_subject_base())
+
     sub_dict = dict(
         DOMAIN=ipautil.format_netloc(api.env.domain),
         IPA_CA_RECORD=ipalib.constants.IPA_CA_RECORD,
         CRL_ISSUER='CN=Certificate Authority,o=ipaca',
-        SUBJECT_DN_O=dsinstance.DsInstance().find_subject_base(),
+        SUBJECT_DN_O=_subject_base_cache[api.env.basedn],
     )
-    return ipautil.template_file(
+    config = ipautil.template_file(
         '/usr/share/ipa/profiles/{}.cfg'.format(profile_id), sub_dict)
+    _profile_config_cache[profile_id] = config
+    return config
 
 def import_included_profiles():
-    server_id = installutils.realm_to_serverid(api.env.realm)
-    dogtag_uri = 'ldapi://%%2fvar%%2frun%%2fslapd-%s.socket' % server_id
-    conn = ldap2.ldap2(api, ldap_uri=dogtag_uri)
-    if not conn.isconnected():
-        conn.connect(autobind=True)
-
-    ensure_entry(
-        DN(('cn', 'ca'), api.env.basedn),
-        objectclass=['top', 'nsContainer'],
-        cn=['ca'],
-    )
-    ensure_entry(
-        DN(api.env.container_certprofile, api.env.basedn),
-        objectclass=['top', 'nsContainer'],
-        cn=['certprofiles'],
-    )
+    conn = ldap2.ldap2(api, ldap_uri=_dogtag_ldapi_uri())
+    conn.connect(autobind=True)
+    try:
+        ensure_entry(
+            DN(('cn', 'ca'), api.env.basedn),
+            objectclass=['top', 'nsContainer'],
+            cn=['ca'],
+        )
+        ensure_entry(
+            DN(api.env.container_certprofile, api.env.basedn),
+            objectclass=['top', 'nsContainer'],
+            cn=['certprofiles'],
+        )
 
-    api.Backend.ra_certprofile._read_password()
-    api.Backend.ra_certprofile.override_port = 8443
+        _prepare_ra_backend(api.Backend.ra_certprofile)
 
-    for (profile_id, desc, store_issued) in dogtag.INCLUDED_PROFILES:
-        dn = DN(('cn', profile_id),
-            api.env.container_certprofile, api.env.basedn)
+        # look up all present profiles at once
         try:
-            conn.get_entry(dn)
-            continue  # the profile is present
+            entries = conn.get_entries(
+                DN(api.env.container_certprofile, api.env.basedn),
+                conn.SCOPE_ONELEVEL, '(objectclass=*)', ['cn'])
         except errors.NotFound:
-            # profile not found; add it
-            entry = conn.make_entry(
-                dn,
-                objectclass=['ipacertprofile'],
-                cn=[profile_id],
-                description=[desc],
-                ipacertprofilestoreissued=['TRUE' if store_issued else 'FALSE'],
-            )
-            conn.add_entry(entry)
+            entries = []
+        existing = {entry.single_value['cn'].lower() for entry in entries}
 
-            # Create the profile, replacing any existing profile of same name
-            profile_data = __get_profile_config(profile_id)
-            _create_dogtag_profile(profile_id, profile_data, overwrite=True)
-            root_logger.info("Imported profile '%s'", profile_id)
+        missing = [
+            (profile_id, desc, store_issued)
+            for (profile_id, desc, store_issued) in dogtag.INCLUDED_PROFILES
+            if profile_id.lower() not in existing
+        ]
+        if not missing:
+            api.Backend.ra_certprofile.override_port = None
+            return
 
-    api.Backend.ra_certprofile.override_port = None
-    conn.disconnect()
+        with api.Backend.ra_certprofile as profile_api:
+            for (profile_id, desc, store_issued) in missing:
+                # profile not found; add it
+                dn = DN(('cn', profile_id),
+                        api.env.container_certprofile, api.env.basedn)
+                entry = conn.make_entry(
+                    dn,
+                    objectclass=['ipacertprofile'],
+                    cn=[profile_id],
+                    description=[desc],
+                    ipacertprofilestoreissued=[
+                        'TRUE' if store_issued else 'FALSE'],
+                )
+                conn.add_entry(entry)
+
+                # Create the profile, replacing any existing profile of same
+                # name
+                profile_data = __get_profile_config(profile_id)
+                _create_dogtag_profile(
+                    profile_api, profile_id, profile_data, overwrite=True)
+                root_logger.info("Imported profile '%s'", profile_id)
+
+        api.Backend.ra_certprofile.override_port = None
+    finally:
+        conn.disconnect()
 
 
 def repair_profile_caIPAserviceCert():
@@ -1634,34 +1978,30 @@ def repair_profile_caIPAserviceCert():
     This function detects and repairs occurrences of this problem.
 
     """
-    api.Backend.ra_certprofile._read_password()
-    api.Backend.ra_certprofile.override_port = 8443
+    _prepare_ra_backend(api.Backend.ra_certprofile)
 
     profile_id = 'caIPAserviceCert'
 
     with api.Backend.ra_certprofile as profile_api:
         try:
-            cur_config = profile_api.read_profile(profile_id).splitlines()
+            cur_config = profile_api.read_profile(profile_id)
         except errors.RemoteRetrieveError:
             # no profile there to check/repair
             api.Backend.ra_certprofile.override_port = None
             return
 
-    indicators = [
-        "policyset.serverCertSet.1.default.params.name="
-            "CN=$request.req_subject_name.cn$, OU=pki-ipa, O=IPA ",
-        "policyset.serverCertSet.9.default.params.crlDistPointsPointName_0="
-            "https://ipa.example.com/ipa/crl/MasterCRL.bin",
-        ]
-    need_repair = all(l in cur_config for l in indicators)
+        found = _CAIPASERVICECERT_INDICATORS_RE.findall(cur_config)
+        need_repair = set(found) == _CAIPASERVICECERT_INDICATORS
 
-    if need_repair:
-        root_logger.debug(
-            "Detected that profile '{}' has been replaced with "
-            "incorrect version; begin repair.".format(profile_id))
-        _create_dogtag_profile(
-            profile_id, __get_profile_config(profile_id), overwrite=True)
-        root_logger.debug("Repair of profile '{}' complete.".format(profile_id))
+        if need_repair:
+            root_logger.debug(
+                "Detected that profile '{}' has been replaced with "
+                "incorrect version; begin repair.".format(profile_id))
+            _create_dogtag_profile(
+                profile_api, profile_id, __get_profile_config(profile_id),
+                overwrite=True)
+            root_logger.debug(
+                "Repair of profile '{}' complete.".format(profile_id))
 
     api.Backend.ra_certprofile.override_port = None
 
@@ -1678,77 +2018,111 @@ def migrate_profiles_to_ldap():
     """
     ensure_ldap_profiles_container()
 
-    api.Backend.ra_certprofile._read_password()
-    api.Backend.ra_certprofile.override_port = 8443
+    _prepare_ra_backend(api.Backend.ra_certprofile)
 
-    with open(paths.CA_CS_CFG_PATH) as f:
-        cs_cfg = f.read()
-    match = re.search(r'^profile\.list=(\S*)', cs_cfg, re.MULTILINE)
-    profile_ids = match.group(1).split(',')
+    profile_ids, profile_attrs = _load_cs_cfg_profile_index()
 
-    for profile_id in profile_ids:
-        match = re.search(
-            r'^profile\.{}\.config=(\S*)'.format(profile_id),
-            cs_cfg, re.MULTILINE
-        )
-        if match is None:
-            root_logger.info("No file for profile '%s'; skipping", profile_id)
-            continue
-        filename = match.group(1)
+    with api.Backend.ra_certprofile as profile_api:
+        for profile_id in profile_ids:
+            attrs = profile_attrs.get(profile_id, {})
+            filename = attrs.get('config')
+            if filename is None:
+                root_logger.info(
+                    "No file for profile '%s'; skipping", profile_id)
+                continue
 
-        match = re.search(
-            r'^profile\.{}\.class_id=(\S*)'.format(profile_id),
-            cs_cfg, re.MULTILINE
-        )
-        if match is None:
-            root_logger.info("No class_id for profile '%s'; skipping", profile_id)
-            continue
-        class_id = match.group(1)
-
-        with open(filename) as f:
-            profile_data = f.read()
-            if profile_data[-1] != '\n':
-                profile_data += '\n'
-            profile_data += 'profileId={}\n'.format(profile_id)
-            profile_data += 'classId={}\n'.format(class_id)
-
-            # Import the profile, but do not replace it if it already exists.
-            # This prevents replicas from replacing IPA-managed profiles with
-            # Dogtag default profiles of same name.
+            class_id = attrs.get('class_id')
+            if class_id is None:
+                root_logger.info(
+                    "No class_id for profile '%s'; skipping", profile_id)
+                continue
+
+            with open(filename) as f:
+                body = f.read()
+            if not body.endswith('\n'):
+                body += '\n'
+            profile_data = ''.join([
+                body,
+                'profileId=', profile_id, '\n',
+                'classId=', class_id, '\n',
+            ])
+
+            # Do not import again profiles that were already migrated with
+            # the same content, but make sure they are still enabled
+            if not isinstance(profile_data, bytes):
+                profile_bytes = profile_data.encode('utf-8')
+            else:
+                profile_bytes = profile_data
+            profile_hash = hashlib.sha256(profile_bytes).hexdigest()
+            state = 'migrated_profile_{}'.format(profile_id)
+            if (sysupgrade.get_upgrade_state('dogtag', state) == profile_hash
+                    and _enable_migrated_profile(profile_api, profile_id)):
+                continue
+
+            # Import the profile, but do not replace it if it already
+            # exists. This prevents replicas from replacing IPA-managed
+            # profiles with Dogtag default profiles of same name.
             #
-            _create_dogtag_profile(profile_id, profile_data, overwrite=False)
+            _create_dogtag_profile(
+                profile_api, profile_id, profile_data, overwrite=False)
+            sysupgrade.set_upgrade_state('dogtag', state, profile_hash)
 
     api.Backend.ra_certprofile.override_port = None
 
 
-def _create_dogtag_profile(profile_id, profile_data, overwrite):
-    with api.Backend.ra_certprofile as profile_api:
-        # import the profile
-        try:
-            profile_api.create_profile(profile_data)
-            root_logger.info("Profile '%s' successfully migrated to LDAP",
-                             profile_id)
-        except errors.RemoteRetrieveError as e:
-            root_logger.debug("Error migrating '{}': {}".format(
-                profile_id, e))
-
-            # profile already exists
-            if overwrite:
-                try:
-                    profile_api.disable_profile(profile_id)
-                except errors.RemoteRetrieveError:
-                    root_logger.debug(
-                        "Failed to disable profile '%s' "
-                        "(it is probably already disabled)")
-                profile_api.update_profile(profile_id, profile_data)
-
-        # enable the profile
+def _enable_migrated_profile(profile_api, profile_id):
+    """
+    Enable a profile whose content was already migrated to LDAP.
+
+    Return ``False`` if the profile no longer exists in Dogtag and has to
+    be imported again, otherwise ``True``.
+    """
+    try:
+        profile_api.enable_profile(profile_id)
+    except errors.RemoteRetrieveError:
+        # already enabled, or missing
         try:
-            profile_api.enable_profile(profile_id)
+            profile_api.read_profile(profile_id)
         except errors.RemoteRetrieveError:
-            root_logger.debug(
-                "Failed to enable profile '%s' "
-                "(it is probably already enabled)")
+            return False
+    root_logger.debug(
+        "Profile '%s' already migrated; not importing", profile_id)
+    return True
+
+
+def _create_dogtag_profile(profile_api, profile_id, profile_data, overwrite):
+    """
+    Import a profile to Dogtag and enable it.
+
+    ``profile_api`` is the entered ``ra_certprofile`` backend, so that
+    a batch of profiles is imported in a single REST API session.
+    """
+    # import the profile
+    try:
+        profile_api.create_profile(profile_data)
+        root_logger.info("Profile '%s' successfully migrated to LDAP",
+                         profile_id)
+    except errors.RemoteRetrieveError as e:
+        root_logger.debug("Error migrating '{}': {}".format(
+            profile_id, e))
+
+        # profile already exists
+        if overwrite:
+            try:
+                profile_api.disable_profile(profile_id)
+            except errors.RemoteRetrieveError:
+                root_logger.debug(
+                    "Failed to disable profile '%s' "
+                    "(it is probably already disabled)")
+            profile_api.update_profile(profile_id, profile_data)
+
+    # enable the profile
+    try:
+        profile_api.enable_profile(profile_id)
+    except errors.RemoteRetrieveError:
+        root_logger.debug(
+            "Failed to enable profile '%s' "
+            "(it is probably already enabled)")
 
 
 def ensure_ipa_authority_entry():
@@ -1764,8 +2138,7 @@ def ensure_ipa_authority_entry():
 
     # find out authority id, issuer DN and subject DN of IPA CA
     #
-    api.Backend.ra_lightweight_ca._read_password()
-    api.Backend.ra_lightweight_ca.override_port = 8443
+    _prepare_ra_backend(api.Backend.ra_lightweight_ca)
     with api.Backend.ra_lightweight_ca as lwca:
         data = lwca.read_ca('host-authority')
         attrs = dict(
@@ -1775,32 +2148,28 @@ def ensure_ipa_authority_entry():
         )
     api.Backend.ra_lightweight_ca.override_port = None
 
-    ensure_entry(
-        DN(api.env.container_ca, api.env.basedn),
-        objectclass=['top', 'nsContainer'],
-        cn=['cas'],
-    )
-    ensure_entry(
-        DN(('cn', ipalib.constants.IPA_CA_CN), api.env.container_ca, api.env.basedn),
+    attrs.update(
         objectclass=['top', 'ipaca'],
         cn=[ipalib.constants.IPA_CA_CN],
         description=['IPA CA'],
-        **attrs
     )
+    ensure_dn_chain([
+        (DN(api.env.container_ca, api.env.basedn),
+         dict(objectclass=['top', 'nsContainer'], cn=['cas'])),
+        (DN(('cn', ipalib.constants.IPA_CA_CN),
+            api.env.container_ca, api.env.basedn),
+         attrs),
+    ])
 
 
 def ensure_default_caacl():
     """Add the default CA ACL if missing."""
-    ensure_entry(
-        DN(('cn', 'ca'), api.env.basedn),
-        objectclass=['top', 'nsContainer'],
-        cn=['ca'],
-    )
-    ensure_entry(
-        DN(api.env.container_caacl, api.env.basedn),
-        objectclass=['top', 'nsContainer'],
-        cn=['certprofiles'],
-    )
+    ensure_dn_chain([
+        (DN(('cn', 'ca'), api.env.basedn),
+         dict(objectclass=['top', 'nsContainer'], cn=['ca'])),
+        (DN(api.env.container_caacl, api.env.basedn),
+         dict(objectclass=['top', 'nsContainer'], cn=['certprofiles'])),
+    ])
 
     if not api.Command.caacl_find()['result']:
         api.Command.caacl_add(u'hosts_services_caIPAserviceCert',
@@ -1817,6 +2186,12 @@ def add_lightweight_ca_tracking_requests(logger, lwcas):
     The IPA CA, if present, is skipped.
 
     """
+    # cert-nickname -> request id of the existing tracking requests
+    tracked = certmonger.get_request_ids_by_nickname({
+        'cert-database': paths.PKI_TOMCAT_ALIAS_DIR,
+        'ca-name': ipalib.constants.RENEWAL_CA_NAME,
+    })
+
     for entry in lwcas:
         if ipalib.constants.IPA_CA_CN in entry['cn']:
             continue
@@ -1824,15 +2199,10 @@ def add_lightweight_ca_tracking_requests(logger, lwcas):
         nickname = "{} {}".format(
                 ipalib.constants.IPA_CA_NICKNAME,
                 entry['ipacaid'][0])
-        criteria = {
-            'cert-database': paths.PKI_TOMCAT_ALIAS_DIR,
-            'cert-nickname': nickname,
-            'ca-name': ipalib.constants.RENEWAL_CA_NAME,
-        }
-        request_id = certmonger.get_request_id(criteria)
+        request_id = tracked.get(nickname)
         if request_id is None:
             try:
-                certmonger.dogtag_start_tracking(
+                request_id = certmonger.dogtag_start_tracking(
                     secdir=paths.PKI_TOMCAT_ALIAS_DIR,
                     pin=certmonger.get_pin('internal'),
                     pinfile=None,
@@ -1841,7 +2211,7 @@ def add_lightweight_ca_tracking_requests(logger, lwcas):
                     pre_command='stop_pkicad',
                     post_command='renew_ca_cert "%s"' % nickname,
                 )
-                request_id = certmonger.get_request_id(criteria)
+                tracked[nickname] = request_id
                 certmonger.modify(request_id, profile='ipaCACertRenewal')
                 logger.debug(
                     'Lightweight CA renewal: '
@@ -1861,14 +2231,55 @@ def update_ipa_conf():
     Update IPA configuration file to ensure that RA plugins are enabled and
     that CA host points to localhost
     """
-    parser = RawConfigParser()
-    parser.read(paths.IPA_DEFAULT_CONF)
-    parser.set('global', 'enable_ra', 'True')
-    parser.set('global', 'ra_plugin', 'dogtag')
-    parser.set('global', 'dogtag_version', '10')
-    parser.remove_option('global', 'ca_host')
+    # Edit the lines in place, so that comments and the order of options
+    # are preserved
+    options = dict(_IPA_CONF_RA_OPTIONS)
+    with open(paths.IPA_DEFAULT_CONF) as f:
+        lines = f.readlines()
+
+    new_lines = []
+    section = None
+    global_end = None
+    seen = set()
+    skip_continuation = False
+    for line in lines:
+        if skip_continuation and line[:1].isspace() and line.strip():
+            continue
+        skip_continuation = False
+
+        match = _IPA_CONF_SECTION_RE.match(line)
+        if match is not None:
+            if section == 'global':
+                global_end = len(new_lines)
+            section = match.group(1).strip()
+        elif section == 'global':
+            match = _IPA_CONF_OPTION_RE.match(line)
+            if match is not None and match.group(1).lower() in options:
+                option = match.group(1).lower()
+                skip_continuation = True
+                if options[option] is None or option in seen:
+                    continue
+                seen.add(option)
+                line = '%s = %s\n' % (option, options[option])
+        new_lines.append(line)
+    if section == 'global':
+        global_end = len(new_lines)
+
+    missing = ['%s = %s\n' % (option, value)
+               for option, value in _IPA_CONF_RA_OPTIONS
+               if value is not None and option not in seen]
+    # the last line may lack a newline, do not glue anything onto it
+    if new_lines and not new_lines[-1].endswith('\n'):
+        new_lines[-1] += '\n'
+    if global_end is None:
+        new_lines.append('[global]\n')
+        global_end = len(new_lines)
+    while global_end > 0 and not new_lines[global_end - 1].strip():
+        global_end -= 1
+    new_lines[global_end:global_end] = missing
+
     with open(paths.IPA_DEFAULT_CONF, 'w') as f:
-        parser.write(f)
+        f.write(''.join(new_lines))
 
 
 if __name__ == "__main__":
@@ -394,6 +394,25 @@ def set_directive(filename, directive, value, quotes=True, separator=' ',
         the `quote_char` are first escaped to avoid unparseable directives
    :param quote_char: the character used for quoting `value`
     """
+    set_directives(filename, [(directive, value)], quotes=quotes,
+                   separator=separator, quote_char=quote_char)
+
+
+def set_directives(filename, directives, quotes=True, separator=' ',
+                   quote_char='\"', atomic=False):
+    """Set multiple name/value pair directives in a configuration file.
+
+    The file is read and written only once, regardless of the number of
+    directives, and it is not written at all if every directive already
+    has the requested value. See `set_directive` for the meaning of the
+    arguments.
+
+   :param directives: sequence of (directive, value) pairs
+   :param atomic: write a temporary file in the same directory and rename
+                  it over the original, so readers never see a partially
+                  written file. The SELinux context of the file is
+                  restored afterwards.
+    """
 
     def format_directive(directive, value, separator, quotes, quote_char):
         directive_sep = "{directive}{separator}".format(directive=directive,
@@ -408,26 +427,54 @@ def set_directive(filename, directive, value, quotes=True, separator=' ',
         return "{directive_sep}{value}\n".format(
             directive_sep=directive_sep, value=transformed_value)
 
-    valueset = False
+    valueset = set()
+    changed = False
     st = os.stat(filename)
     fd = open(filename)
     newfile = []
     for line in fd:
-        if line.lstrip().startswith(directive):
-            valueset = True
-            if value is not None:
-                newfile.append(
-                    format_directive(
-                        directive, value, separator, quotes, quote_char))
+        stripped = line.lstrip()
+        for directive, value in directives:
+            if stripped.startswith(directive):
+                valueset.add(directive)
+                if value is not None:
+                    newline = format_directive(
+                        directive, value, separator, quotes, quote_char)
+                    changed = changed or newline != line
+                    newfile.append(newline)
+                else:
+                    changed = True
+                break
         else:
             newfile.append(line)
     fd.close()
-    if not valueset:
-        if value is not None:
+    for directive, value in directives:
+        if directive not in valueset and value is not None:
+            changed = True
             newfile.append(
                 format_directive(
                     directive, value, separator, quotes, quote_char))
 
+    if not changed:
+        # all directives already have the requested values
+        return
+
+    if atomic:
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                       prefix=os.path.basename(filename))
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write("".join(newfile))
+                os.fchmod(f.fileno(), st.st_mode & 0o7777)
+                os.fchown(f.fileno(), st.st_uid, st.st_gid)
+            os.rename(tmpname, filename)
+        except Exception:
+            os.unlink(tmpname)
+            raise
+        # the renamed file carries the label of the temporary file
+        tasks.restore_context(filename)
+        return
+
     fd = open(filename, "w")
     fd.write("".join(newfile))
     fd.close()
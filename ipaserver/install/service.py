@@ -21,10 +21,9 @@ import sys
 import os
 import pwd
 import socket
-import datetime
-import traceback
-import tempfile
+import time
 
+import ldap
 import six
 
 from ipalib.install import certstore, sysrestore
@@ -40,6 +39,9 @@ from ipaplatform.paths import paths
 if six.PY3:
     unicode = str
 
+# time.monotonic() is not available in Python 2
+_monotonic = getattr(time, 'monotonic', time.time)
+
 # The service name as stored in cn=masters,cn=ipa,cn=etc. In the tuple
 # the first value is the *nix service name, the second the start order.
 SERVICE_LIST = {
@@ -60,25 +62,39 @@ SERVICE_LIST = {
     'DNSKeySync': ('ipa-dnskeysyncd', 110),
 }
 
+# The service name mapped to its start order
+START_ORDER = dict(
+    (name, order) for name, (_svc, order) in SERVICE_LIST.items())
+
+# Constant parts of the DNs used for service entries, relative to the suffix
+_MASTERS_TAIL = DN(('cn', 'masters'), ('cn', 'ipa'), ('cn', 'etc'))
+_SERVICES_TAIL = DN(('cn', 'services'), ('cn', 'accounts'))
+_COMPUTERS_TAIL = DN(('cn', 'computers'), ('cn', 'accounts'))
+
+# Service entries enabled on a master, only the cn values vary per search
+_ENABLED_SERVICE_FILTER = (
+    '(&(objectClass=ipaConfigObject)(ipaConfigString=enabledService))')
+
+# find_providing_server() results,
+# {(svcname, masters DN, LDAP URI): (time, hosts)}
+_providing_servers_cache = {}
+_PROVIDING_SERVERS_TTL = 60
+
+
 def print_msg(message, output_fd=sys.stdout):
     root_logger.debug(message)
-    output_fd.write(message)
-    output_fd.write("\n")
+    output_fd.write(message + "\n")
     output_fd.flush()
 
 
 def format_seconds(seconds):
     """Format a number of seconds as an English minutes+seconds message"""
     parts = []
-    minutes, seconds = divmod(seconds, 60)
+    minutes, seconds = divmod(int(seconds), 60)
     if minutes:
-        parts.append('%d minute' % minutes)
-        if minutes != 1:
-            parts[-1] += 's'
+        parts.append('%d minute%s' % (minutes, '' if minutes == 1 else 's'))
     if seconds or not minutes:
-        parts.append('%d second' % seconds)
-        if seconds != 1:
-            parts[-1] += 's'
+        parts.append('%d second%s' % (seconds, '' if seconds == 1 else 's'))
     return ' '.join(parts)
 
 def add_principals_to_group(admin_conn, group, member_attr, principals):
@@ -88,16 +104,12 @@ def add_principals_to_group(admin_conn, group, member_attr, principals):
     member_attr -- attribute to represent members
     principals  -- list of DNs to add as members
     """
+    mod = [(ldap.MOD_ADD, member_attr, list(principals))]
     try:
-        current = admin_conn.get_entry(group)
-        members = current.get(member_attr, [])
-        if len(members) == 0:
-            current[member_attr] = []
-        for amember in principals:
-            if not(amember in members):
-                current[member_attr].extend([amember])
-        admin_conn.update_entry(current)
-    except errors.NotFound:
+        # send only the new values instead of reading the whole (possibly
+        # large) member list first
+        admin_conn.modify_s(group, mod)
+    except ldap.NO_SUCH_OBJECT:
         entry = admin_conn.make_entry(
                 group,
                 objectclass=["top", "GroupOfNames"],
@@ -105,9 +117,64 @@ def add_principals_to_group(admin_conn, group, member_attr, principals):
                 member=principals,
         )
         admin_conn.add_entry(entry)
-    except errors.EmptyModlist:
-        # If there are no changes just pass
-        pass
+    except ldap.TYPE_OR_VALUE_EXISTS:
+        # some of the principals are members already, add the rest one by one
+        for amember in principals:
+            try:
+                admin_conn.modify_s(
+                    group, [(ldap.MOD_ADD, member_attr, [amember])])
+            except ldap.TYPE_OR_VALUE_EXISTS:
+                pass
+
+
+def find_providing_servers(svcnames, conn, api=api):
+    """
+    :param svcnames: The services to find
+    :param conn: a connection to the LDAP server
+    :return: dict mapping each service name to the list of host names
+        providing it, the list is empty if there is none
+
+    Find the servers providing several services with a single search.
+    """
+    dn = DN(_MASTERS_TAIL, api.env.basedn)
+    now = time.time()
+    result = {}
+    missing = []
+    for svcname in svcnames:
+        cached = _providing_servers_cache.get((svcname, dn, conn.ldap_uri))
+        if cached is not None and now - cached[0] < _PROVIDING_SERVERS_TTL:
+            # a copy, so that callers cannot modify the cached list
+            result[svcname] = list(cached[1])
+        else:
+            result[svcname] = []
+            missing.append(svcname)
+
+    if not missing:
+        return result
+
+    query_filter = conn.combine_filters(
+        [_ENABLED_SERVICE_FILTER,
+         conn.make_filter_from_attr('cn', missing, rules='|')],
+        rules='&')
+    try:
+        entries, _trunc = conn.find_entries(filter=query_filter, base_dn=dn)
+    except errors.NotFound:
+        entries = []
+
+    # cn is matched case-insensitively by the server
+    names = dict((svcname.lower(), svcname) for svcname in missing)
+    for entry in entries:
+        svcname = names.get(entry.dn[0].value.lower())
+        if svcname is not None:
+            result[svcname].append(entry.dn[1].value)
+
+    # empty results are not cached, a service may get enabled any time
+    for svcname in missing:
+        if result[svcname]:
+            _providing_servers_cache[svcname, dn, conn.ldap_uri] = (
+                now, list(result[svcname]))
+
+    return result
 
 
 def find_providing_server(svcname, conn, host_name=None, api=api):
@@ -119,22 +186,13 @@ def find_providing_server(svcname, conn, host_name=None, api=api):
 
     Find a server that is a CA.
     """
-    dn = DN(('cn', 'masters'), ('cn', 'ipa'), ('cn', 'etc'), api.env.basedn)
-    query_filter = conn.make_filter({'objectClass': 'ipaConfigObject',
-                                     'ipaConfigString': 'enabledService',
-                                     'cn': svcname}, rules='&')
-    try:
-        entries, _trunc = conn.find_entries(filter=query_filter, base_dn=dn)
-    except errors.NotFound:
+    hosts = find_providing_servers([svcname], conn, api=api)[svcname]
+    if not hosts:
         return None
-    if len(entries):
-        if host_name is not None:
-            for entry in entries:
-                if entry.dn[1].value == host_name:
-                    return host_name
-        # if the preferred is not found, return the first in the list
-        return entries[0].dn[1].value
-    return None
+    if host_name is not None and host_name in hosts:
+        return host_name
+    # if the preferred is not found, return the first in the list
+    return hosts[0]
 
 
 class Service(object):
@@ -169,28 +227,42 @@ class Service(object):
         self.service_user = service_user
         self.dm_password = None  # silence pylint
         self.promote = False
+        self.__service_pent = None
+        self.__principal = None
 
     @property
     def principal(self):
-        if any(attr is None for attr in (self.realm, self.fqdn,
-                                         self.service_prefix)):
+        key = (self.service_prefix, self.fqdn, self.realm)
+        if any(attr is None for attr in key):
             return
 
-        return unicode(
-            kerberos.Principal(
-                (self.service_prefix, self.fqdn), realm=self.realm))
+        # the attributes are set directly by the installers, so the cached
+        # name is only valid as long as they stay the same
+        if self.__principal is None or self.__principal[0] != key:
+            self.__principal = (key, unicode(
+                kerberos.Principal(
+                    (self.service_prefix, self.fqdn), realm=self.realm)))
+        return self.__principal[1]
+
+    @property
+    def _service_pent(self):
+        """
+        The password database entry of the service user, looked up once.
+        """
+        if (self.__service_pent is None or
+                self.__service_pent.pw_name != self.service_user):
+            self.__service_pent = pwd.getpwnam(self.service_user)
+        return self.__service_pent
 
     def _ldap_mod(self, ldif, sub_dict=None, raise_on_err=True,
                   ldap_uri=None, dm_password=None):
-        pw_name = None
         fd = None
         path = os.path.join(paths.USR_SHARE_IPA_DIR, ldif)
         nologlist = []
+        txt = None
 
         if sub_dict is not None:
             txt = ipautil.template_file(path, sub_dict)
-            fd = ipautil.write_tmp_file(txt)
-            path = fd.name
 
             # do not log passwords
             if 'PASSWORD' in sub_dict:
@@ -198,7 +270,7 @@ class Service(object):
             if 'RANDOM_PASSWORD' in sub_dict:
                 nologlist.append(sub_dict['RANDOM_PASSWORD'])
 
-        args = [paths.LDAPMODIFY, "-v", "-f", path]
+        args = [paths.LDAPMODIFY, "-v"]
 
         # As we always connect to the local host,
         # use URI of admin connection
@@ -208,29 +280,36 @@ class Service(object):
         args += ["-H", ldap_uri]
 
         if dm_password:
-            [pw_fd, pw_name] = tempfile.mkstemp()
-            os.write(pw_fd, dm_password)
-            os.close(pw_fd)
-            auth_parms = ["-x", "-D", "cn=Directory Manager", "-y", pw_name]
-        # Use GSSAPI auth when not using DM password or not being root
-        elif os.getegid() != 0:
-            auth_parms = ["-Y", "GSSAPI"]
-        # Default to EXTERNAL auth mechanism
+            # pass the password on stdin so that it never touches the disk,
+            # the LDIF has to be read from a file then
+            if txt is not None:
+                fd = ipautil.write_tmp_file(txt)
+                path = fd.name
+            args += ["-f", path]
+            stdin = dm_password
+            auth_parms = ["-x", "-D", "cn=Directory Manager",
+                          "-y", paths.DEV_STDIN]
         else:
-            auth_parms = ["-Y", "EXTERNAL"]
+            # templated LDIF is fed to ldapmodify on stdin rather than
+            # written to a temporary file first
+            if txt is None:
+                args += ["-f", path]
+            stdin = txt
+            # Use GSSAPI auth when not using DM password or not being root
+            if os.getegid() != 0:
+                auth_parms = ["-Y", "GSSAPI"]
+            # Default to EXTERNAL auth mechanism
+            else:
+                auth_parms = ["-Y", "EXTERNAL"]
 
         args += auth_parms
 
         try:
-            try:
-                ipautil.run(args, nolog=nologlist)
-            except ipautil.CalledProcessError as e:
-                root_logger.critical("Failed to load %s: %s" % (ldif, str(e)))
-                if raise_on_err:
-                    raise
-        finally:
-            if pw_name:
-                os.remove(pw_name)
+            ipautil.run(args, stdin=stdin, nolog=nologlist)
+        except ipautil.CalledProcessError as e:
+            root_logger.critical("Failed to load %s: %s", ldif, e)
+            if raise_on_err:
+                raise
 
     def move_service(self, principal):
         """
@@ -246,13 +325,16 @@ class Service(object):
             # This can happen when installing a replica
             return None
         entry.pop('krbpwdpolicyreference', None)  # don't copy virtual attr
-        newdn = DN(('krbprincipalname', principal), ('cn', 'services'), ('cn', 'accounts'), self.suffix)
-        hostdn = DN(('fqdn', self.fqdn), ('cn', 'computers'), ('cn', 'accounts'), self.suffix)
+        newdn = DN(('krbprincipalname', principal), _SERVICES_TAIL,
+                   self.suffix)
+        hostdn = DN(('fqdn', self.fqdn), _COMPUTERS_TAIL, self.suffix)
         api.Backend.ldap2.delete_entry(entry)
         entry.dn = newdn
-        classes = entry.get("objectclass")
-        classes = classes + ["ipaobject", "ipaservice", "pkiuser"]
-        entry["objectclass"] = list(set(classes))
+        classes = list(entry.get("objectclass", []))
+        present = set(oc.lower() for oc in classes)
+        classes.extend(oc for oc in ["ipaobject", "ipaservice", "pkiuser"]
+                       if oc not in present)
+        entry["objectclass"] = classes
         entry["ipauniqueid"] = ['autogenerate']
         entry["managedby"] = [hostdn]
         api.Backend.ldap2.add_entry(entry)
@@ -264,8 +346,8 @@ class Service(object):
 
         The principal needs to be fully-formed: service/host@REALM
         """
-        dn = DN(('krbprincipalname', principal), ('cn', 'services'), ('cn', 'accounts'), self.suffix)
-        hostdn = DN(('fqdn', self.fqdn), ('cn', 'computers'), ('cn', 'accounts'), self.suffix)
+        dn = DN(('krbprincipalname', principal), _SERVICES_TAIL, self.suffix)
+        hostdn = DN(('fqdn', self.fqdn), _COMPUTERS_TAIL, self.suffix)
         entry = api.Backend.ldap2.make_entry(
             dn,
             objectclass=[
@@ -284,14 +366,26 @@ class Service(object):
 
         This server cert should be in DER format.
         """
-        dn = DN(('krbprincipalname', self.principal), ('cn', 'services'),
-                ('cn', 'accounts'), self.suffix)
-        entry = api.Backend.ldap2.get_entry(dn)
-        entry.setdefault('userCertificate', []).append(self.dercert)
+        dn = DN(('krbprincipalname', self.principal), _SERVICES_TAIL,
+                self.suffix)
+        # add just the new value, the entry may carry many old certificates
+        mod = [(ldap.MOD_ADD, 'userCertificate', [self.dercert])]
+        ldap2 = api.Backend.ldap2
         try:
-            api.Backend.ldap2.update_entry(entry)
+            with ldap2.error_handler():
+                try:
+                    ldap2.modify_s(dn, mod)
+                except ldap.TYPE_OR_VALUE_EXISTS:
+                    raise errors.EmptyModlist()
+        except errors.NotFound:
+            raise
+        except errors.EmptyModlist:
+            root_logger.debug("certificate already present in service %s "
+                              "entry", self.principal)
         except Exception as e:
-            root_logger.critical("Could not add certificate to service %s entry: %s" % (self.principal, str(e)))
+            root_logger.critical(
+                "Could not add certificate to service %s entry: %s",
+                self.principal, e)
 
     def import_ca_certs(self, db, ca_is_configured, conn=None):
         if conn is None:
@@ -408,11 +502,9 @@ class Service(object):
 
         def run_step(message, method):
             self.print_msg(message)
-            s = datetime.datetime.now()
+            s = _monotonic()
             method()
-            e = datetime.datetime.now()
-            d = e - s
-            root_logger.debug("  duration: %d seconds" % d.seconds)
+            root_logger.debug("  duration: %.2f seconds", _monotonic() - s)
 
         step = 0
         steps_iter = iter(self.steps)
@@ -425,7 +517,7 @@ class Service(object):
             if not (isinstance(e, SystemExit) and
                     e.code == 0):  # pylint: disable=no-member
                 # show the traceback, so it's not lost if cleanup method fails
-                root_logger.debug("%s" % traceback.format_exc())
+                root_logger.debug("%s", e, exc_info=True)
                 self.print_msg('  [error] %s: %s' % (type(e).__name__, e))
 
                 # run through remaining methods marked run_after_failure
@@ -442,22 +534,39 @@ class Service(object):
     def ldap_enable(self, name, fqdn, dm_password=None, ldap_suffix='',
                     config=[]):
         assert isinstance(ldap_suffix, DN)
+        _providing_servers_cache.clear()
         self.disable()
 
-        entry_name = DN(('cn', name), ('cn', fqdn), ('cn', 'masters'), ('cn', 'ipa'), ('cn', 'etc'), ldap_suffix)
+        entry_name = DN(('cn', name), ('cn', fqdn), _MASTERS_TAIL, ldap_suffix)
 
-        # enable disabled service
+        # a compare tells whether the service is already enabled without
+        # fetching and scanning all of its configuration values
+        ldap2 = api.Backend.ldap2
         try:
-            entry = api.Backend.ldap2.get_entry(
-                entry_name, ['ipaConfigString'])
+            with ldap2.error_handler():
+                enabled = ldap2.conn.compare_s(
+                    str(entry_name), 'ipaConfigString',
+                    ldap2.encode(u'enabledService'))
         except errors.NotFound:
-            pass
-        else:
-            if any(u'enabledservice' == val.lower()
-                   for val in entry.get('ipaConfigString', [])):
-                root_logger.debug("service %s startup entry already enabled", name)
-                return
+            enabled = None
+        except errors.MidairCollision:
+            # the entry has no ipaConfigString value at all
+            enabled = False
+
+        if enabled:
+            root_logger.debug("service %s startup entry already enabled", name)
+            return
+
+        # enable disabled service
+        entry = None
+        if enabled is not None:
+            try:
+                entry = api.Backend.ldap2.get_entry(
+                    entry_name, ['ipaConfigString'])
+            except errors.NotFound:
+                pass
 
+        if entry is not None:
             entry.setdefault('ipaConfigString', []).append(u'enabledService')
 
             try:
@@ -472,7 +581,7 @@ class Service(object):
             root_logger.debug("service %s startup entry enabled", name)
             return
 
-        order = SERVICE_LIST[name][1]
+        order = START_ORDER[name]
         entry = api.Backend.ldap2.make_entry(
             entry_name,
             objectclass=["nsContainer", "ipaConfigObject"],
@@ -489,34 +598,22 @@ class Service(object):
 
     def ldap_disable(self, name, fqdn, ldap_suffix):
         assert isinstance(ldap_suffix, DN)
-
-        entry_dn = DN(('cn', name), ('cn', fqdn), ('cn', 'masters'),
-                        ('cn', 'ipa'), ('cn', 'etc'), ldap_suffix)
-        search_kw = {'ipaConfigString': u'enabledService'}
-        filter = api.Backend.ldap2.make_filter(search_kw)
+        _providing_servers_cache.clear()
+
+        entry_dn = DN(('cn', name), ('cn', fqdn), _MASTERS_TAIL,
+                      ldap_suffix)
+        # ipaConfigString matches case-insensitively, so the server removes
+        # the value whatever its case is
+        mod = [(ldap.MOD_DELETE, 'ipaConfigString', [u'enabledService'])]
+        ldap2 = api.Backend.ldap2
         try:
-            entries, _truncated = api.Backend.ldap2.find_entries(
-                filter=filter,
-                attrs_list=['ipaConfigString'],
-                base_dn=entry_dn,
-                scope=api.Backend.ldap2.SCOPE_BASE)
-        except errors.NotFound:
-            root_logger.debug("service %s startup entry already disabled", name)
+            with ldap2.error_handler():
+                ldap2.modify_s(entry_dn, mod)
+        except (errors.NotFound, errors.MidairCollision):
+            # MidairCollision is how error_handler reports NO_SUCH_ATTRIBUTE
+            root_logger.debug("service %s startup entry already disabled",
+                              name)
             return
-
-        assert len(entries) == 1  # only one entry is expected
-        entry = entries[0]
-
-        # case insensitive
-        for value in entry.get('ipaConfigString', []):
-            if value.lower() == u'enabledservice':
-                entry['ipaConfigString'].remove(value)
-                break
-
-        try:
-            api.Backend.ldap2.update_entry(entry)
-        except errors.EmptyModlist:
-            pass
         except:
             root_logger.debug("failed to disable service %s startup entry", name)
             raise
@@ -524,8 +621,9 @@ class Service(object):
         root_logger.debug("service %s startup entry disabled", name)
 
     def ldap_remove_service_container(self, name, fqdn, ldap_suffix):
-        entry_dn = DN(('cn', name), ('cn', fqdn), ('cn', 'masters'),
-                        ('cn', 'ipa'), ('cn', 'etc'), ldap_suffix)
+        _providing_servers_cache.clear()
+        entry_dn = DN(('cn', name), ('cn', fqdn), _MASTERS_TAIL,
+                      ldap_suffix)
         try:
             api.Backend.ldap2.delete_entry(entry_dn)
         except errors.NotFound:
@@ -549,11 +647,13 @@ class Service(object):
             * self.dm_password is not none, then DM credentials are used to
               fetch keytab
         """
-        self.fstore.backup_file(self.keytab)
-        try:
-            os.unlink(self.keytab)
-        except OSError:
-            pass
+        # a fresh install has no keytab to back up and remove
+        if os.path.lexists(self.keytab):
+            self.fstore.backup_file(self.keytab)
+            try:
+                os.unlink(self.keytab)
+            except OSError:
+                pass
 
         ldap_uri = self.api.env.ldap_uri
         args = [paths.IPA_GETKEYTAB,
@@ -582,7 +682,7 @@ class Service(object):
         self._add_service_principal()
         self._run_getkeytab()
 
-        pent = pwd.getpwnam(self.service_user)
+        pent = self._service_pent
         os.chown(self.keytab, pent.pw_uid, pent.pw_gid)
 
 
@@ -108,3 +108,15 @@ class test_x509(object):
         assert cert.serial == 1093
         assert cert.not_valid_before == not_before
         assert cert.not_valid_after == not_after
+
+    def test_4_certs_to_pkcs7(self):
+        """
+        Test creating a PKCS #7 message from certificates
+        """
+        cert = x509.load_certificate(goodcert)
+
+        pkcs7 = x509.certs_to_pkcs7([cert, cert])
+        pems = x509.pkcs7_to_pems(pkcs7, x509.DER)
+        assert len(pems) == 2
+        for pem in pems:
+            assert x509.load_certificate(pem) == cert
@@ -0,0 +1,131 @@
+#
+# Copyright (C) 2016  FreeIPA Contributors see COPYING for license
+#
+
+"""
+Tests for the `ipaserver.install.cainstance` module.
+"""
+
+from ipaserver.install import cainstance
+import pytest
+
+
+@pytest.mark.tier0
+def test_get_value():
+    assert cainstance.get_value('defList.defId="subject";') == 'subject'
+    assert cainstance.get_value('x="a=b";') == 'a=b'
+    assert cainstance.get_value('x="line1\\nline2\\r";') == 'line1\nline2\r'
+    assert cainstance.get_value('no separator') is None
+
+
+@pytest.mark.tier0
+def test_get_defList():
+    data = [
+        'defList = new Object();',
+        'defList.defId="subject";',
+        'defList.defConstraint="readonly";',
+        'defList.defVal="CN=foo";',
+        'defList = new Object();',
+        'defList.defId="validity";',
+        'defList.defConstraint="";',
+        'defList.defVal="180";',
+        'defList = new Object();',
+        'defList.defId="incomplete";',
+        'defList = new Object();',
+        'defList.defId="keyUsage";',
+        'unrelated="line";',
+        'defList.defVal="digitalSignature";',
+    ]
+    assert cainstance.get_defList(data) == {
+        'validity': '180',
+        'keyUsage': 'digitalSignature',
+    }
+
+
+@pytest.mark.tier0
+def test_get_outputList():
+    data = [
+        'outputList = new Object();',
+        'outputList.outputId="pretty_cert";',
+        'outputList.outputVal="cert";',
+        'outputList = new Object();',
+        'outputList.outputId="b64_cert";',
+        'outputList = new Object();',
+        'outputList.outputId="serial";',
+        'outputList.outputVal="0x1";',
+    ]
+    assert cainstance.get_outputList(data) == {
+        'pretty_cert': 'cert',
+        'serial': '0x1',
+    }
+
+
+@pytest.mark.tier0
+def test_update_ipa_conf(tmpdir, monkeypatch):
+    conf = tmpdir.join('default.conf')
+    conf.write(
+        '[global]\n'
+        '# managed by IPA\n'
+        'basedn = dc=example,dc=com\n'
+        'enable_ra = False\n'
+        'ca_host = ca.example.com\n'
+        '\n'
+        '[other]\n'
+        'ra_plugin = none\n'
+    )
+    monkeypatch.setattr(cainstance.paths, 'IPA_DEFAULT_CONF', str(conf))
+
+    cainstance.update_ipa_conf()
+
+    assert conf.read() == (
+        '[global]\n'
+        '# managed by IPA\n'
+        'basedn = dc=example,dc=com\n'
+        'enable_ra = True\n'
+        'ra_plugin = dogtag\n'
+        'dogtag_version = 10\n'
+        '\n'
+        '[other]\n'
+        'ra_plugin = none\n'
+    )
+
+
+@pytest.mark.tier0
+def test_update_ipa_conf_no_trailing_newline(tmpdir, monkeypatch):
+    conf = tmpdir.join('default.conf')
+    conf.write(
+        '[global]\n'
+        'basedn = dc=example,dc=com'
+    )
+    monkeypatch.setattr(cainstance.paths, 'IPA_DEFAULT_CONF', str(conf))
+
+    cainstance.update_ipa_conf()
+
+    assert conf.read() == (
+        '[global]\n'
+        'basedn = dc=example,dc=com\n'
+        'enable_ra = True\n'
+        'ra_plugin = dogtag\n'
+        'dogtag_version = 10\n'
+    )
+
+
+@pytest.mark.tier0
+def test_update_ipa_conf_no_global(tmpdir, monkeypatch):
+    conf = tmpdir.join('default.conf')
+    conf.write(
+        '[other]\n'
+        'ra_plugin = none'
+    )
+    monkeypatch.setattr(cainstance.paths, 'IPA_DEFAULT_CONF', str(conf))
+
+    cainstance.update_ipa_conf()
+
+    assert conf.read() == (
+        '[other]\n'
+        'ra_plugin = none\n'
+        '[global]\n'
+        'enable_ra = True\n'
+        'ra_plugin = dogtag\n'
+        'dogtag_version = 10\n'
+    )
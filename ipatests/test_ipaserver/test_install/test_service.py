@@ -36,3 +36,4 @@ def test_format_seconds():
     assert service.format_seconds(62) == '1 minute 2 seconds'
     assert service.format_seconds(120) == '2 minutes'
     assert service.format_seconds(125) == '2 minutes 5 seconds'
+    assert service.format_seconds(60.5) == '1 minute'